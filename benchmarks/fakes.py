@@ -0,0 +1,65 @@
+import asyncio
+
+from types import SimpleNamespace
+
+from benchmarks.fixtures import character_document
+from character import Character
+from memory_store import MemoryStore
+from scheduler import Scheduler
+
+
+# Just enough of discord.py for the cog to run without a connection
+class FakeMessage:
+    def __init__(self, content: str = None):
+        self.content = content
+
+    async def add_reaction(self, emoji):
+        pass
+
+    async def edit(self, **fields):
+        self.content = fields.get("content", self.content)
+
+    async def delete(self):
+        pass
+
+
+class FakeContext:
+    def __init__(self, channel: int = 1, author: int = 1, command: str = "npc"):
+        self.channel = SimpleNamespace(id=channel)
+        self.author = SimpleNamespace(id=author)
+        self.guild = None
+        self.command = SimpleNamespace(name=command)
+        self.message = FakeMessage()
+        self.sent = 0
+
+    async def send(self, content: str = None, **fields) -> FakeMessage:
+        self.sent += 1
+        return FakeMessage(content)
+
+
+async def populated_store(count: int, channel: int = 1) -> MemoryStore:
+    store = MemoryStore()
+    characters = []
+
+    for index in range(count):
+        document = character_document(index, channel)
+        del document["_id"]
+
+        character = Character.from_dict(document)
+        character._dirty = None
+        characters.append(character)
+
+    await Character.commit_all(store, characters)
+    return store
+
+
+async def create_cog(store: MemoryStore):
+    # The cog reads DISCORD_ADMIN_ID on import, which the suite sets before calling this
+    from cog_npchelper_dnd5e import Cog_NpcHelper_Dnd5e
+
+    bot = SimpleNamespace(loop=asyncio.get_running_loop(), store=store, scheduler=Scheduler())
+    cog = Cog_NpcHelper_Dnd5e(bot)
+
+    # Let the cache watcher and initialize() tasks run once
+    await asyncio.sleep(0)
+    return cog
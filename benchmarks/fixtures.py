@@ -0,0 +1,51 @@
+ABILITIES = ["Strength", "Dexterity", "Constitution", "Intelligence", "Wisdom", "Charisma"]
+
+SKILLS = [
+    "Acrobatics", "Animal Handling", "Arcana", "Athletics", "Deception", "History",
+    "Insight", "Intimidation", "Investigation", "Medicine", "Nature", "Perception",
+    "Performance", "Persuasion", "Religion", "Sleight of Hand", "Stealth", "Survival"
+]
+
+ATTACKS = [
+    ("Scimitar", 4, "1d6+2", 1),
+    ("Shortbow", 4, "1d6+2", 0),
+    ("Bite", 5, "2d4+3", 1),
+    ("Claws", 5, "2d6+3", 1)
+]
+
+
+def character_document(index: int, channel: int = 1) -> dict:
+    # Shaped like a 5e statblock stored by Character.commit
+    return {
+        "_id": index,
+        "channel": str(channel),
+        "sheet": f"sheet{index}",
+        "system": "dnd5",
+        "name": f"Goblin {index}",
+        "name_lower": f"goblin {index}",
+        "portrait": "",
+        "initiative": {"modifier": 2, "keywords": []},
+        "abilities": [{"name": name, "modifier": 1, "keywords": []} for name in ABILITIES],
+        "saves": [{"name": name, "modifier": 3, "keywords": ["adv"] if name == "Dexterity" else []} for name in ABILITIES],
+        "skills": [{"name": name, "modifier": 2, "keywords": ["dis"] if name == "Stealth" else []} for name in SKILLS],
+        "attacks": [
+            {"name": name, "hit": hit, "damage": damage, "keywords": [], "group": group, "critrange": 20, "critmultiplier": 2}
+            for name, hit, damage, group in ATTACKS
+        ]
+    }
+
+
+def sheet_response(index: int) -> dict:
+    # A recorded values:batchGet response for the same statblock, in NAMED_RANGES order; like the API, rows drop trailing blanks
+    rows = [
+        [["dnd5"]],
+        [[f"Goblin {index}"]],
+        [],
+        [["2"]],
+        [[name, "12", "1"] for name in ABILITIES],
+        [[name, "", "3"] + (["1"] if name == "Dexterity" else []) for name in ABILITIES],
+        [[name, "", "2"] + (["-1"] if name == "Stealth" else []) for name in SKILLS],
+        [[name, str(hit), damage, str(group)] for name, hit, damage, group in ATTACKS]
+    ]
+
+    return {"valueRanges": [{"values": values} if len(values) > 0 else {} for values in rows]}
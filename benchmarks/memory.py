@@ -0,0 +1,38 @@
+import copy
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import character_document
+from character import Character
+
+COUNT = 5000
+
+
+def measure(build) -> int:
+    tracemalloc.start()
+    objects = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del objects
+    return size
+
+
+def main():
+    documents = [character_document(i) for i in range(COUNT)]
+
+    # Plain dicts are what characters looked like in memory before the typed entries
+    dict_size = measure(lambda: [copy.deepcopy(document) for document in documents])
+    typed_size = measure(lambda: [Character.from_dict(document) for document in documents])
+
+    print(f"{COUNT} characters")
+    print(f"dict layout:  {dict_size / COUNT:10.0f} bytes per character")
+    print(f"typed layout: {typed_size / COUNT:10.0f} bytes per character")
+    print(f"saved:        {100 * (1 - typed_size / dict_size):10.1f}%")
+
+
+if __name__ == "__main__":
+    main()
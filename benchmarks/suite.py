@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DISCORD_ADMIN_ID", "0")
+
+from benchmarks.fakes import FakeContext, create_cog, populated_store
+from benchmarks.fixtures import character_document, sheet_response
+from character import Character
+from cog_npchelper_dnd5e import parse_arguments
+from google_sheet import GoogleSheet, RecordedTransport
+
+REPEAT = 5
+PARTY_SIZE = 8
+
+# (name, setup, calls per repeat); setup returns the operation to time, sync or async
+BENCHMARKS = []
+
+
+def benchmark(name: str, number: int):
+    def decorator(setup):
+        BENCHMARKS.append((name, setup, number))
+        return setup
+
+    return decorator
+
+
+# Argument parsing
+
+@benchmark("parse_arguments", 20000)
+async def bench_parse_arguments():
+    commands = [
+        ("attack", "scimitar"),
+        ("check", "stealth", "adv"),
+        ("save", "dexterity", "dis", "-b", "2"),
+        ("attack", "bite", "vs", "ac", "15", "adv", "-pow", "3")
+    ]
+
+    def run():
+        for command in commands:
+            parse_arguments(command)
+
+    return run
+
+
+# Character lookups and serialization
+
+@benchmark("character.get_ability", 100000)
+async def bench_get_ability():
+    character = Character.from_dict(character_document(0))
+    return lambda: character.get_ability("dex")
+
+
+@benchmark("character.get_save", 100000)
+async def bench_get_save():
+    character = Character.from_dict(character_document(0))
+    return lambda: character.get_save("wis")
+
+
+@benchmark("character.get_skill", 100000)
+async def bench_get_skill():
+    character = Character.from_dict(character_document(0))
+    return lambda: character.get_skill("sleight")
+
+
+@benchmark("character.get_attacks", 100000)
+async def bench_get_attacks():
+    character = Character.from_dict(character_document(0))
+    return lambda: character.get_attacks("bite")
+
+
+@benchmark("character.from_dict", 5000)
+async def bench_from_dict():
+    document = character_document(0)
+    return lambda: Character.from_dict(document)
+
+
+@benchmark("character.to_dict", 5000)
+async def bench_to_dict():
+    character = Character.from_dict(character_document(0))
+    return character.to_dict
+
+
+@benchmark("character.update", 2000)
+async def bench_update():
+    GoogleSheet.set_transport(RecordedTransport({"sheet0": sheet_response(0)}))
+    character = Character.from_dict(character_document(0))
+
+    # Forced, so every call parses instead of stopping at the content hash
+    return lambda: character.update(force=True)
+
+
+# Commands end to end, from the cache lookup to the sends
+
+async def command(*arguments):
+    cog = await create_cog(await populated_store(PARTY_SIZE))
+    context = FakeContext()
+
+    # The first call loads the channel into the cache, as a warm bot would have
+    await cog.action.callback(cog, context, *arguments)
+
+    async def run():
+        await cog.action.callback(cog, context, *arguments)
+
+    return run
+
+
+@benchmark("execute_check", 2000)
+async def bench_execute_check():
+    return await command("goblin 1", "check", "stealth")
+
+
+@benchmark("execute_save", 2000)
+async def bench_execute_save():
+    return await command("goblin 1", "save", "dex", "adv")
+
+
+@benchmark("execute_attack", 2000)
+async def bench_execute_attack():
+    return await command("goblin 1", "attack", "scimitar")
+
+
+@benchmark("execute_initiative", 2000)
+async def bench_execute_initiative():
+    return await command("goblin 1", "initiative")
+
+
+@benchmark("execute_simulate", 20)
+async def bench_execute_simulate():
+    return await command("goblin 1", "simulate", "claws", "vs", "ac", "15")
+
+
+@benchmark("execute_check_party", 500)
+async def bench_execute_check_party():
+    return await command("*", "check", "perception")
+
+
+@benchmark("execute_attack_group", 500)
+async def bench_execute_attack_group():
+    return await command("goblin 1", "x20", "attack", "scimitar", "vs", "ac", "13")
+
+
+@benchmark("execute_update_all", 200)
+async def bench_execute_update_all():
+    sheets = [f"sheet{index}" for index in range(PARTY_SIZE)]
+    GoogleSheet.set_transport(RecordedTransport({sheet: sheet_response(index) for index, sheet in enumerate(sheets)}, {sheet: "r1" for sheet in sheets}))
+
+    cog = await create_cog(await populated_store(PARTY_SIZE))
+    context = FakeContext()
+
+    # The first run reads every sheet; after that each one is unchanged, so only its revision is checked
+    await cog.update.callback(cog, context, "*")
+
+    async def run():
+        await cog.update.callback(cog, context, "*")
+
+    return run
+
+
+# Running and comparing
+
+async def measure(operation, number: int, repeat: int) -> float:
+    # Best of several repeats, in seconds per call; the minimum is the least disturbed by other load
+    is_async = asyncio.iscoroutinefunction(operation)
+    best = float("inf")
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+
+        if is_async:
+            for _ in range(number):
+                await operation()
+        else:
+            for _ in range(number):
+                operation()
+
+        best = min(best, (time.perf_counter() - started) / number)
+
+    return best
+
+
+async def run(name_filter: str, repeat: int) -> dict:
+    results = {}
+
+    for name, setup, number in BENCHMARKS:
+        if name_filter is not None and name_filter not in name:
+            continue
+
+        results[name] = await measure(await setup(), number, repeat)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the parse, lookup and roll paths of the bot.")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against results saved earlier with --save")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown that counts as a regression (default 0.10)")
+    arguments = parser.parse_args()
+
+    results = asyncio.run(run(arguments.filter, arguments.repeat))
+    baseline = {}
+
+    if arguments.compare is not None:
+        with open(arguments.compare) as file:
+            baseline = json.load(file)["results"]
+
+    regressions = []
+
+    for name, seconds in results.items():
+        line = f"{name:<28}{seconds * 1e6:12.2f} us{1 / seconds:14.0f} /s"
+
+        if name in baseline:
+            change = seconds / baseline[name] - 1
+            line += f"{change * 100:+10.1f}%"
+
+            if change > arguments.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+
+        print(line)
+
+    if arguments.save is not None:
+        with open(arguments.save, "w") as file:
+            json.dump({
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results
+            }, file, indent=4)
+
+    if len(regressions) > 0:
+        print(f"{len(regressions)} benchmarks slower than the baseline by more than {arguments.threshold * 100:.0f}%: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,62 @@
 from __future__ import annotations
 
-import re
+import hashlib
+import json
+
+from bisect import bisect_left
+from datetime import datetime
 
 import gspread
 
-from pymongo.collection import Collection
+import metrics
 
+from character_store import LOCAL_SHEET_PREFIX, CharacterStore, CharacterWrite, ConflictError, join
 from google_sheet import GoogleSheet
+from single_flight import SingleFlight
+from stats import Attack, Keyword, Modifier, Stat
+
+NAMED_RANGES = ["system", "name", "portrait", "initiative", "Abilities", "Saves", "Skills", "Attacks"]
+
+# The bulky parts of a character document; queries can leave out the ones they don't need
+SECTIONS = ["initiative", "abilities", "saves", "skills", "attacks"]
+PROJECTION_BASE = ["channel", "sheet", "system", "name", "name_lower", "portrait"]
+
+# Everything read from the sheet, which every channel linked to it shares
+SHARED_SLOTS = [
+    "version", "revision", "content_hash", "last_synced", "system", "name", "portrait", "initiative", "abilities", "saves", "skills", "attacks",
+    "_ability_index", "_save_index", "_skill_index", "_attack_index", "_attack_lists"
+]
+
+# What parsing a sheet fills in
+PARSED_SLOTS = [
+    "system", "name", "portrait", "initiative", "abilities", "saves", "skills", "attacks",
+    "_ability_index", "_save_index", "_skill_index", "_attack_index", "_attack_lists"
+]
+
+# Sheet refreshes in flight and write locks, keyed by sheet, since every channel linked to a sheet shares its data
+REFRESHES = SingleFlight()
+
 
+def hash_ranges(ranges: dict) -> str:
+    return hashlib.sha1(json.dumps(ranges, sort_keys=True).encode("utf-8")).hexdigest()
 
-def parse_advantage(cells: list, column: int, block: list):
+
+def first_cell(rows: list, default=None):
+    if len(rows) > 0 and len(rows[0]) > 0:
+        return rows[0][0]
+
+    return default
+
+
+def parse_advantage(cells: list, column: int) -> int:
     if len(cells) > column:
         advantage = int(cells[column])
         if advantage > 0:
-            block.append("adv")
+            return Keyword.ADV
         elif advantage < 0:
-            block.append("dis")
+            return Keyword.DIS
+
+    return 0
 
 
 def parse_optional_int(cells: list, column: int, default: int):
@@ -26,235 +67,396 @@ def parse_optional_int(cells: list, column: int, default: int):
     return default
 
 
+class PrefixIndex:
+    __slots__ = ("_names", "_positions")
+
+    def __init__(self, entries: list):
+        names = [entry.name.lower() for entry in entries]
+        order = sorted(range(len(entries)), key=lambda position: names[position])
+
+        self._names = [names[position] for position in order]
+        self._positions = order
+
+    def find(self, prefix: str) -> int:
+        # Names sharing the prefix are adjacent once sorted; the earliest one on the sheet wins
+        index = bisect_left(self._names, prefix)
+        found = None
+
+        while index < len(self._names) and self._names[index].startswith(prefix):
+            position = self._positions[index]
+            if found is None or position < found:
+                found = position
+            index += 1
+
+        return found
+
+
 class Character:
+    __slots__ = (
+        "_id", "_store", "_cache", "_dirty", "_sections", "_removed", "channel", "sheet", "version", "revision", "content_hash", "last_synced", "system", "name", "portrait",
+        "initiative", "abilities", "saves", "skills", "attacks",
+        "_ability_index", "_save_index", "_skill_index", "_attack_index", "_attack_lists"
+    )
+
     def __init__(self):
         self._id = None
-        self._collection: Collection = None
+        self._store: CharacterStore = None
+        self._cache = None
+        self._dirty: set = None
+        self._sections: set = None  # None when fully loaded
+        self._removed = False
         self.channel: int = -1
         self.sheet = ""
+        self.version: int = None  # Bumped by every write, to catch writes based on stale data
+        self.revision: str = None
+        self.content_hash: str = None
+        self.last_synced: datetime = None
         self.system = ""
         self.name = ""
         self.portrait = ""
-        self.initiative = {}
+        self.initiative = Modifier()
         self.abilities = []
         self.saves = []
         self.skills = []
         self.attacks = []
+        self.build_index()
+
+    @property
+    def refresh_key(self):
+        # A character without a sheet shares nothing with the others
+        return self.sheet or self._id
+
+    async def refresh(self, force: bool = False) -> bool:
+        # Reads the sheet and stores the result. Concurrent refreshes of the same sheet, from any channel, share one
+        # fetch and one write; the callers that joined take the result over into their own link instead of repeating it.
+        if REFRESHES.pending(self.refresh_key):
+            metrics.counter("npchelper_coalesced_refreshes_total").inc()
+
+        leader, changed = await REFRESHES.run(self.refresh_key, self._refresh, force)
+
+        # A refresh through a link that was removed meanwhile may have written nothing, so this one still has to,
+        # starting from whatever the sheet holds now
+        while leader is not self and leader._removed:
+            await self.load_shared()
+            leader, changed = await REFRESHES.run(self.refresh_key, self._refresh, force)
+
+        if leader is not self:
+            for key in SHARED_SLOTS:
+                setattr(self, key, getattr(leader, key))
 
-    def update(self, sheet_url: str = None):
+            self._dirty = set()
+
+        return changed
+
+    async def _refresh(self, force: bool) -> tuple[Character, bool]:
+        async with REFRESHES.lock(self.refresh_key):
+            if self._removed:
+                return self, False
+
+            changed = await self.update_async(force=force)
+            await self.commit()
+
+        return self, changed
+
+    def update(self, sheet_url: str = None, force: bool = False) -> bool:
+        return self.load(self.fetch(sheet_url), force)
+
+    async def update_async(self, sheet_url: str = None, force: bool = False) -> bool:
         if sheet_url is not None:
             self.sheet = gspread.utils.extract_id_from_url(sheet_url)
 
-        sheet = GoogleSheet.get_service().open_by_key(self.sheet).get_worksheet(0)
+        # Characters imported from a snapshot have no sheet to read
+        if not self.sheet or self.sheet.startswith(LOCAL_SHEET_PREFIX):
+            self.mark_synced()
+            return False
 
-        # Parse character sheet
-        system = sheet.get("system").first()
-        name = sheet.get("name").first()
-        portrait = sheet.get("portrait").first()
-        initiative = sheet.get("initiative")[0]
-        abilities = sheet.get("Abilities")
-        saves = sheet.get("Saves")
-        skills = sheet.get("Skills")
-        attacks = sheet.get("Attacks")
-
-        # Fill in character object
-        self.system = system
-        self.name = name
-        self.portrait = portrait
-
-        self.initiative = {}
-        self.initiative["modifier"] = int(initiative[0])
-        self.initiative["keywords"] = []
-        parse_advantage(initiative, 1, self.initiative["keywords"])
+        # Drive metadata is a cheap check that doesn't count against the Sheets quota
+        with metrics.span("sheet.revision"):
+            revision = await GoogleSheet.run(GoogleSheet.modified_time, self.sheet, quota=False)
 
-        self.abilities = []
-        self.saves = []
-        self.skills = []
-        self.attacks = []
+        if revision is not None and revision == self.revision and not force:
+            self.mark_synced()
+            return False
+
+        with metrics.span("sheet.fetch"):
+            ranges = await GoogleSheet.run(self.fetch)
+
+        self.mark_synced()
+        changed = self.load(ranges, force)
+
+        # Only record the revision once its data is loaded, so a sheet that failed to parse is read again next time
+        if revision != self.revision:
+            self.revision = revision
+            self._mark_dirty("revision")
+
+        return changed
+
+    def load(self, ranges: dict, force: bool = False) -> bool:
+        content_hash = hash_ranges(ranges)
+
+        if content_hash == self.content_hash and not force:
+            return False
+
+        before = self.to_dict()
+
+        with metrics.span("character.parse"):
+            self.parse(ranges)
+
+        self.content_hash = content_hash
+        after = self.to_dict()
+
+        for key, value in after.items():
+            if value != before[key]:
+                self._mark_dirty(key)
+
+        return True
+
+    async def load_shared(self) -> bool:
+        # Another channel may already hold this sheet; starting from its data, an unchanged sheet isn't fetched again
+        sheet_document = await self._store.find_sheet(self.sheet)
+
+        if sheet_document is None:
+            return False
+
+        shared = Character.from_dict(join({"channel": str(self.channel), "sheet": self.sheet}, sheet_document))
+
+        for key in SHARED_SLOTS:
+            setattr(self, key, getattr(shared, key))
+
+        return True
+
+    def relink(self, channel: int, document_id) -> Character:
+        # The same sheet data as seen from another channel's link
+        character = Character.from_dict(dict(self.to_dict(), _id=document_id, channel=str(channel)))
+        character._store = self._store
+        character._cache = self._cache
+        return character
+
+    def mark_synced(self):
+        self.last_synced = datetime.utcnow()
+        self._mark_dirty("last_synced")
+
+    def _mark_dirty(self, key: str):
+        # A character that was never stored is written in full, so only loaded ones track fields
+        if self._dirty is not None:
+            self._dirty.add(key)
+
+    def fetch(self, sheet_url: str = None) -> dict:
+        if sheet_url is not None:
+            self.sheet = gspread.utils.extract_id_from_url(sheet_url)
+
+        return GoogleSheet.batch_get(self.sheet, NAMED_RANGES)
+
+    def parse(self, ranges: dict):
+        # Parse character sheet
+        system = first_cell(ranges["system"])
+        name = first_cell(ranges["name"])
+        portrait = first_cell(ranges["portrait"])
+        initiative = ranges["initiative"][0]
+        abilities = ranges["Abilities"]
+        saves = ranges["Saves"]
+        skills = ranges["Skills"]
+        attacks = ranges["Attacks"]
+
+        # Fill in a fresh character, so a malformed row leaves this one as it was
+        parsed = Character()
+        parsed.system = system
+        parsed.name = name
+        parsed.portrait = portrait
+
+        parsed.initiative = Modifier(int(initiative[0]), parse_advantage(initiative, 1))
+
+        parsed.abilities = []
+        parsed.saves = []
+        parsed.skills = []
+        parsed.attacks = []
 
         for ability in abilities:
-            new_ability = {}
-            new_ability["name"] = ability[0]
-            new_ability["modifier"] = int(ability[2])
-            new_ability["keywords"] = []
-            parse_advantage(ability, 3, new_ability["keywords"])
-            self.abilities.append(new_ability)
+            parsed.abilities.append(Stat(ability[0], int(ability[2]), parse_advantage(ability, 3)))
 
         for save in saves:
-            new_save = {}
-            new_save["name"] = save[0]
-            if system == "dnd5":
-                new_save["modifier"] = int(save[2])
-            else:
-                new_save["modifier"] = int(save[3])
-            new_save["keywords"] = []
-            parse_advantage(save, 3, new_save["keywords"])
-            self.saves.append(new_save)
+            modifier = int(save[2]) if system == "dnd5" else int(save[3])
+            parsed.saves.append(Stat(save[0], modifier, parse_advantage(save, 3)))
 
         for skill in skills:
-            new_skill = {}
-            new_skill["name"] = skill[0]
-            if system == "dnd5":
-                new_skill["modifier"] = int(skill[2])
-            else:
-                new_skill["modifier"] = int(skill[3])
-            new_skill["keywords"] = []
-            parse_advantage(skill, 3, new_skill["keywords"])
-            self.skills.append(new_skill)
+            modifier = int(skill[2]) if system == "dnd5" else int(skill[3])
+            parsed.skills.append(Stat(skill[0], modifier, parse_advantage(skill, 3)))
 
         for attack in attacks:
-            new_attack = {}
-
-            new_attack["name"] = attack[0]
-            new_attack["hit"] = int(attack[1])
-            new_attack["damage"] = attack[2]
-            new_attack["keywords"] = []
-
-            new_attack_group: int = 0
-            new_attack_critrange: int = 20
-            new_attack_critmultiplier: int = 2
+            new_attack = Attack(attack[0], int(attack[1]), attack[2])
 
             if system == "dnd5":
-                new_attack_group = parse_optional_int(attack, 3, new_attack_group)
-                new_attack_critrange = parse_optional_int(attack, 4, new_attack_critrange)
+                new_attack.group = parse_optional_int(attack, 3, new_attack.group)
+                new_attack.critrange = parse_optional_int(attack, 4, new_attack.critrange)
 
-                parse_advantage(attack, 4, new_attack["keywords"])
+                new_attack.keywords = parse_advantage(attack, 4)
             else:
-                new_attack_critrange = parse_optional_int(attack, 3, new_attack_critrange)
-                new_attack_critmultiplier = parse_optional_int(attack, 4, new_attack_critmultiplier)
+                new_attack.critrange = parse_optional_int(attack, 3, new_attack.critrange)
+                new_attack.critmultiplier = parse_optional_int(attack, 4, new_attack.critmultiplier)
 
-                parse_advantage(attack, 5, new_attack["keywords"])
+                new_attack.keywords = parse_advantage(attack, 5)
 
-                if new_attack["name"].lower().endswith("[2h]"):
-                    new_attack["name"] = new_attack["name"][:-4].strip()
-                    new_attack["keywords"].append("2h")
+                if new_attack.name.lower().endswith("[2h]"):
+                    new_attack.name = new_attack.name[:-4].strip()
+                    new_attack.keywords |= Keyword.TWO_HANDED
 
-            new_attack["group"] = new_attack_group
-            new_attack["critrange"] = new_attack_critrange
-            new_attack["critmultiplier"] = new_attack_critmultiplier
+            parsed.attacks.append(new_attack)
 
-            self.attacks.append(new_attack)
+        parsed.build_index()
+
+        for key in PARSED_SLOTS:
+            setattr(self, key, getattr(parsed, key))
 
     async def commit(self):
-        if self._collection is None:
+        if self._store is None or self._removed:
             return
 
-        await self._collection.update_one(
-            {
-                "channel": str(self.channel),
-                "name": str(self.name)
-            },
-            {"$set": self.to_dict()},
-            upsert=True
-        )
+        await Character.commit_all(self._store, [self])
+
+    def _commit_write(self) -> CharacterWrite:
+        document = self.to_dict()
+
+        if self._dirty is not None:
+            document = {key: document[key] for key in self._dirty}
+
+        document["updated"] = datetime.utcnow()
+        document["version"] = (self.version or 0) + 1
+
+        # Without an id yet, the write goes to whichever document has this channel and name
+        return CharacterWrite(self._id, str(self.channel), self.sheet, str(self.name), document, self.version)
 
     async def delete(self):
-        if self._collection is None:
+        if self._store is None:
             return
 
         if self._id is None:
             return
 
-        await self._collection.find_one_and_delete(
-            {"_id": self._id}
-        )
-
-    def get_ability(self, name: str) -> dict:
-        for ability in self.abilities:
-            ability_name: str = ability["name"]
-            if ability_name.lower().startswith(name.lower()):
-                return ability
+        # Waits for a refresh of this character to finish, and keeps later ones from writing it back
+        async with REFRESHES.lock(self.refresh_key):
+            with metrics.span("store.delete"):
+                await self._store.delete(self._id)
 
-        return None
+            self._removed = True
 
-    def get_save(self, name: str) -> dict:
-        for save in self.saves:
-            save_name: str = save["name"]
-            if save_name.lower().startswith(name.lower()):
-                return save
+        if self._cache is not None:
+            self._cache.discard(self)
 
-        return None
+    def get_ability(self, name: str) -> Stat:
+        position = self._ability_index.find(name.lower())
+        return None if position is None else self.abilities[position]
 
-    def get_skill(self, name: str) -> dict:
-        for skill in self.skills:
-            skill_name: str = skill["name"]
-            if skill_name.lower().startswith(name.lower()):
-                return skill
+    def get_save(self, name: str) -> Stat:
+        position = self._save_index.find(name.lower())
+        return None if position is None else self.saves[position]
 
-        return None
-
-    def get_attacks(self, name: str) -> list[dict]:
-        attack_group = 0
-
-        # Find single attack, or determine group
-        for attack in self.attacks:
-            attack_name: str = attack["name"]
-            if attack_name.lower().startswith(name.lower()):
-                if attack["group"] == 0:
-                    return [attack]  # Make sure to return a list
+    def get_skill(self, name: str) -> Stat:
+        position = self._skill_index.find(name.lower())
+        return None if position is None else self.skills[position]
 
-                attack_group = attack["group"]
-                break
+    def get_attacks(self, name: str) -> list[Attack]:
+        position = self._attack_index.find(name.lower())
+        return None if position is None else self._attack_lists[position]
 
-        # No attack found
-        if attack_group == 0:
-            return None
+    def build_index(self):
+        self._ability_index = PrefixIndex(self.abilities)
+        self._save_index = PrefixIndex(self.saves)
+        self._skill_index = PrefixIndex(self.skills)
+        self._attack_index = PrefixIndex(self.attacks)
 
-        # Find all attacks for group
-        attacks = []
+        # Each attack resolves to itself, or to every attack in its multi-attack group
+        groups = {}
 
         for attack in self.attacks:
-            if attack["group"] == attack_group:
-                attacks.append(attack)
+            if attack.group != 0:
+                groups.setdefault(attack.group, []).append(attack)
 
-        return attacks
+        self._attack_lists = [groups[attack.group] if attack.group != 0 else [attack] for attack in self.attacks]
 
     @classmethod
-    def create(cls, collection: Collection, channel: int, sheet_url: str) -> Character:
+    def create(cls, store: CharacterStore, channel: int, sheet_url: str, cache=None) -> Character:
         character = cls()
 
-        character._collection = collection
+        character._store = store
+        character._cache = cache
         character.channel = channel
         character.sheet = gspread.utils.extract_id_from_url(sheet_url)
 
         return character
 
     @classmethod
-    async def get_all(cls, collection: Collection, channel: int) -> list[Character]:
-        result_list = collection.find(
-            {"channel": str(channel)}
-        )
+    @metrics.traced("store.write")
+    async def commit_all(cls, store: CharacterStore, characters: list[Character]):
+        characters = [character for character in characters if character._dirty is None or len(character._dirty) > 0]
+
+        for character in characters:
+            # Writing the empty sections would wipe them from the stored document
+            if character._sections is not None:
+                raise ValueError(f"Can't commit {character.name}: it was loaded with only {', '.join(sorted(character._sections)) or 'its name'}.")
+
+        if len(characters) == 0:
+            return
+
+        writes = [character._commit_write() for character in characters]
+
+        try:
+            document_ids = await store.write_all(writes)
+        except ConflictError:
+            # Cached copies are behind whatever was written first; the next command reloads them
+            metrics.counter("npchelper_write_conflicts_total").inc()
+
+            for character in characters:
+                if character._cache is not None:
+                    character._cache.invalidate(character.channel)
 
-        character_list = []
+            raise
+
+        for character, write, document_id in zip(characters, writes, document_ids):
+            if document_id is not None:
+                character._id = document_id
+
+            character.version = write.fields["version"]
+            character._dirty = set()
+
+            if character._cache is not None:
+                character._cache.store(character)
+
+    @classmethod
+    def from_store(cls, store: CharacterStore, dct: dict, sections: list[str] = None) -> Character:
+        character = cls.from_dict(dct, sections)
+        character._store = store
+        return character
 
-        async for result_dictionary in result_list:
-            character = Character.from_dict(result_dictionary)
-            character._collection = collection
-            character_list.append(character)
+    @staticmethod
+    def projection(sections: list[str]) -> list[str]:
+        return None if sections is None else PROJECTION_BASE + sections
 
-        return character_list
+    @classmethod
+    @metrics.traced("store.find_all")
+    async def get_all(cls, store: CharacterStore, channel: int, sections: list[str] = None) -> list[Character]:
+        # With sections, only those are loaded and the characters can't be committed
+        result_list = await store.find_all(channel, Character.projection(sections))
+        return [Character.from_store(store, result_dictionary, sections) for result_dictionary in result_list]
 
     @classmethod
-    async def get(cls, collection: Collection, channel: int, name: str, exact: bool = False) -> Character:
-        if exact:
-            name_filter = name
-        else:
-            name_filter = re.compile(name, re.IGNORECASE)
-
-        result_dictionary = await collection.find_one(
-            {
-                "channel": str(channel),
-                "name": name_filter
-            }
-        )
+    @metrics.traced("store.find_stale")
+    async def get_stale(cls, store: CharacterStore, cutoff: datetime) -> Character:
+        result_dictionary = await store.find_stale(cutoff)
 
         if result_dictionary is None:
             return None
 
-        character = Character.from_dict(result_dictionary)
-        character._collection = collection
+        return Character.from_store(store, result_dictionary)
 
-        return character
+    @classmethod
+    @metrics.traced("store.find")
+    async def get(cls, store: CharacterStore, channel: int, name: str, exact: bool = False, sections: list[str] = None) -> Character:
+        result_dictionary = await store.find(channel, name, exact, Character.projection(sections))
+
+        if result_dictionary is None:
+            return None
+
+        return Character.from_store(store, result_dictionary, sections)
 
     # Serialization
 
@@ -262,30 +464,53 @@ class Character:
         return {
             "channel": str(self.channel),
             "sheet": self.sheet,
+            "version": self.version,
+            "revision": self.revision,
+            "content_hash": self.content_hash,
+            "last_synced": self.last_synced,
             "system": self.system,
             "name": self.name,
+            "name_lower": self.name.lower(),
             "portrait": self.portrait,
-            "initiative": self.initiative,
-            "abilities": self.abilities,
-            "saves": self.saves,
-            "skills": self.skills,
-            "attacks": self.attacks
+            "initiative": self.initiative.to_dict(),
+            "abilities": [ability.to_dict() for ability in self.abilities],
+            "saves": [save.to_dict() for save in self.saves],
+            "skills": [skill.to_dict() for skill in self.skills],
+            "attacks": [attack.to_dict() for attack in self.attacks]
         }
 
     @classmethod
-    def from_dict(cls, dct) -> Character:
+    def from_dict(cls, dct, sections: list[str] = None) -> Character:
         character = cls()
 
-        character._id = dct["_id"]
+        character._id = dct.get("_id")
         character.channel = int(dct["channel"])
         character.sheet = dct["sheet"]
+        character.version = dct.get("version")
+        character.revision = dct.get("revision")
+        character.content_hash = dct.get("content_hash")
+        character.last_synced = dct.get("last_synced")
         character.system = dct["system"]
         character.name = dct["name"]
         character.portrait = dct["portrait"]
-        character.initiative = dct["initiative"]
-        character.abilities = dct["abilities"]
-        character.saves = dct["saves"]
-        character.skills = dct["skills"]
-        character.attacks = dct["attacks"]
+
+        if sections is None or "initiative" in sections:
+            character.initiative = Modifier.from_dict(dct["initiative"])
+
+        if sections is None or "abilities" in sections:
+            character.abilities = [Stat.from_dict(ability) for ability in dct["abilities"]]
+
+        if sections is None or "saves" in sections:
+            character.saves = [Stat.from_dict(save) for save in dct["saves"]]
+
+        if sections is None or "skills" in sections:
+            character.skills = [Stat.from_dict(skill) for skill in dct["skills"]]
+
+        if sections is None or "attacks" in sections:
+            character.attacks = [Attack.from_dict(attack) for attack in dct["attacks"]]
+
+        character.build_index()
+        character._dirty = set()
+        character._sections = None if sections is None else set(sections)
 
         return character
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+import traceback
+
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+import metrics
+
+from character import Character
+from character_store import CharacterStore
+from name_index import NameIndex
+
+load_dotenv()
+CHARACTER_CACHE_CHANNELS = int(os.getenv("CHARACTER_CACHE_CHANNELS", "256"))
+CHARACTER_CACHE_TTL = float(os.getenv("CHARACTER_CACHE_TTL", "300"))
+CHARACTER_CACHE_POLL_INTERVAL = float(os.getenv("CHARACTER_CACHE_POLL_INTERVAL", "10"))
+CHARACTER_CACHE_WATCH_BACKOFF_MIN = 1.0
+CHARACTER_CACHE_WATCH_BACKOFF_MAX = 60.0
+
+
+class CharacterCache:
+    def __init__(self, store: CharacterStore, max_channels: int = CHARACTER_CACHE_CHANNELS, ttl: float = CHARACTER_CACHE_TTL):
+        self._store = store
+        self._max_channels = max_channels
+        self._ttl = ttl
+
+        # Channel -> (load time, characters), least recently used first
+        self._channels: OrderedDict[int, tuple[float, list[Character]]] = OrderedDict()
+
+        # Outlives the rosters above, and follows every commit and delete that goes through here
+        self.names = NameIndex()
+
+    @metrics.traced("cache.get_all")
+    async def get_all(self, channel: int, sections: list[str] = None) -> list[Character]:
+        entry = self._channels.get(channel)
+
+        if entry is not None:
+            loaded, characters = entry
+            if time.monotonic() - loaded < self._ttl:
+                self._channels.move_to_end(channel)
+                return characters
+
+        # A cold channel asked for only some sections gets a lighter query, which isn't cached
+        if sections is not None:
+            return await Character.get_all(self._store, channel, sections)
+
+        characters = await Character.get_all(self._store, channel)
+
+        for character in characters:
+            character._cache = self
+
+        self.names.replace(channel, characters)
+        self._channels[channel] = (time.monotonic(), characters)
+        self._channels.move_to_end(channel)
+
+        while len(self._channels) > self._max_channels:
+            self._channels.popitem(last=False)
+
+        return characters
+
+    async def get(self, channel: int, name: str, exact: bool = False) -> Character:
+        characters = await self.get_all(channel)
+
+        if exact:
+            for character in characters:
+                if character.name == name:
+                    return character
+        else:
+            # Rosters are kept in name order, so this is the same match Character.get would pick
+            prefix = name.lower()
+            for character in characters:
+                if character.name.lower().startswith(prefix):
+                    return character
+
+        return None
+
+    def invalidate(self, channel: int):
+        self._channels.pop(channel, None)
+
+    def store(self, character: Character):
+        self.names.add(character)
+        entry = self._channels.get(character.channel)
+
+        if entry is None:
+            self._share(character)
+            return
+
+        characters = entry[1]
+
+        for i, cached in enumerate(characters):
+            if cached is character or cached._id == character._id or cached.name == character.name:
+                characters[i] = character
+                break
+        else:
+            characters.append(character)
+
+        characters.sort(key=lambda cached: cached.name.lower())
+        self._share(character)
+
+    def _share(self, character: Character):
+        # Sheet data is stored once, so other channels linked to the same sheet see the change too
+        for channel, (_, characters) in self._channels.items():
+            if channel == character.channel:
+                continue
+
+            shared = False
+
+            for i, cached in enumerate(characters):
+                if cached.sheet == character.sheet:
+                    characters[i] = character.relink(channel, cached._id)
+                    shared = True
+
+            if shared:
+                characters.sort(key=lambda cached: cached.name.lower())
+
+    def discard(self, character: Character):
+        self.names.remove(character._id)
+        entry = self._channels.get(character.channel)
+
+        if entry is None:
+            return
+
+        characters = entry[1]
+        characters[:] = [cached for cached in characters if cached._id != character._id]
+
+    def _discard_id(self, document_id):
+        self.names.remove(document_id)
+
+        for _, characters in self._channels.values():
+            characters[:] = [cached for cached in characters if cached._id != document_id]
+
+    def _apply(self, document: dict):
+        character = Character.from_store(self._store, document)
+        character._cache = self
+        self.store(character)
+
+    # Invalidation from other writers
+
+    async def watch(self, interval: float = CHARACTER_CACHE_POLL_INTERVAL):
+        # Runs until cancelled. When the store drops out the watch starts over after a backoff, and since a new
+        # watch only reports what changes from then on, everything cached before the outage is loaded again.
+        backoff = 0.0
+
+        while True:
+            try:
+                async for operation, payload in self._store.watch(interval):
+                    backoff = 0.0
+
+                    if operation == "delete":
+                        self._discard_id(payload)
+                    elif int(payload["channel"]) in self._channels:
+                        self._apply(payload)
+
+                # A store nobody else writes to has nothing to report
+                return
+            except self._store.unavailable_errors as error:
+                backoff = min(max(backoff * 2, CHARACTER_CACHE_WATCH_BACKOFF_MIN), CHARACTER_CACHE_WATCH_BACKOFF_MAX)
+                print(f"Cache watch lost the store, retrying in {backoff:.0f}s: {error!r}")
+            except Exception as error:
+                backoff = min(max(backoff * 2, CHARACTER_CACHE_WATCH_BACKOFF_MIN), CHARACTER_CACHE_WATCH_BACKOFF_MAX)
+                print(f"Cache watch failed, retrying in {backoff:.0f}s: {error!r}")
+                traceback.print_exc()
+
+            await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+            self._channels.clear()
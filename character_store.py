@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import os
+import uuid
+
+from datetime import datetime
+from typing import AsyncIterator
+
+from dotenv import load_dotenv
+
+load_dotenv()
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+STORAGE_PATH = os.getenv("STORAGE_PATH", "npchelper.sqlite3")
+
+# Matches every lowercase name starting with a prefix when used as an exclusive upper bound
+PREFIX_END = "\U0010ffff"
+
+# A character is a per-channel link to sheet data stored once per sheet. Links carry the name as well,
+# so channel lookups never touch the sheet data; every other field lives on the shared sheet document.
+LINK_FIELDS = ["channel", "sheet", "name", "name_lower"]
+SHARED_LINK_FIELDS = ["name", "name_lower"]
+
+# Characters without a Google Sheet, such as snapshot imports, get a sheet id of their own
+LOCAL_SHEET_PREFIX = "local:"
+
+
+def local_sheet_id() -> str:
+    return LOCAL_SHEET_PREFIX + uuid.uuid4().hex
+
+
+def project(document: dict, fields: list[str]) -> dict:
+    # For backends without server-side projection: the same subset of fields, plus the id
+    if fields is None:
+        return document
+
+    return {key: value for key, value in document.items() if key == "_id" or key in fields}
+
+
+def join(link: dict, sheet_document: dict) -> dict:
+    # The character document as the rest of the bot sees it, under the link's id
+    document = {key: value for key, value in sheet_document.items() if key != "_id"}
+    document.update(link)
+    return document
+
+
+def split(document: dict) -> tuple[dict, dict]:
+    # (link fields, sheet fields) of a full or partial character document
+    link = {key: value for key, value in document.items() if key in LINK_FIELDS}
+    sheet_document = {key: value for key, value in document.items() if key not in LINK_FIELDS or key in SHARED_LINK_FIELDS}
+
+    if "updated" in document:
+        link["updated"] = document["updated"]
+
+    return link, sheet_document
+
+
+# A pending character write: the link id if known, the (channel, name) key otherwise, and the fields to set.
+# Only writes without an id may create a link, and only writes without a version may create a sheet document;
+# with a version, the write only applies if the sheet document is still at that version.
+class CharacterWrite:
+    __slots__ = ("document_id", "channel", "sheet", "name", "fields", "version")
+
+    def __init__(self, document_id, channel: str, sheet: str, name: str, fields: dict, version: int = None):
+        self.document_id = document_id
+        self.channel = channel
+        self.sheet = sheet
+        self.name = name
+        self.fields = fields
+        self.version = version
+
+
+class ConflictError(Exception):
+    # Another writer stored a newer version of a sheet, or removed the character, since it was loaded
+    def __init__(self, sheet: str):
+        super().__init__(f"Sheet {sheet} was changed or removed by another writer.")
+        self.sheet = sheet
+
+
+class StoreNotReady(Exception):
+    # Commands arrived before the store finished connecting, building indexes and migrating documents
+    def __init__(self):
+        super().__init__("The store is still being prepared.")
+
+
+# Everything the bot keeps between restarts goes through one of these. Documents are plain dicts as
+# produced by Character.to_dict and InitiativeTracker.to_dict, with the backend's link id under "_id".
+class CharacterStore:
+    # Errors that mean the backend is overloaded or unreachable rather than that a command went wrong
+    unavailable_errors: tuple = ()
+
+    async def prepare(self):
+        # Creates indexes and brings documents from older versions up to date
+        pass
+
+    async def close(self):
+        pass
+
+    async def ping(self) -> float:
+        # Round trip time in seconds; raises one of unavailable_errors when the backend can't be reached
+        return 0.0
+
+    async def find_all(self, channel: int, fields: list[str] = None) -> list[dict]:
+        # Every character in the channel, ordered by name_lower; with fields, only those are returned
+        raise NotImplementedError
+
+    async def find(self, channel: int, name: str, exact: bool = False, fields: list[str] = None) -> dict:
+        # Exact matches compare the name as typed; otherwise the first name_lower starting with name.lower()
+        raise NotImplementedError
+
+    async def find_sheet(self, sheet: str) -> dict:
+        # Sheet data already stored for another channel, without any link fields but the name
+        raise NotImplementedError
+
+    async def find_stale(self, cutoff: datetime) -> dict:
+        # Any one character of the least recently synced sheet, if it was last synced before cutoff or never
+        raise NotImplementedError
+
+    async def write_all(self, writes: list[CharacterWrite]) -> list:
+        # Upserts every write in one round trip and returns the link id of each. Sheet fields go to the
+        # shared sheet document, and a new name is copied to every link of the sheet. Raises ConflictError
+        # when a write's link is gone or a versioned write finds its sheet missing or at another version.
+        raise NotImplementedError
+
+    async def delete(self, document_id):
+        # Removes the link, and the sheet data with its last link
+        raise NotImplementedError
+
+    def watch(self, interval: float) -> AsyncIterator[tuple[str, object]]:
+        # Yields ("update", document) and ("delete", document id) for writes made by other processes
+        raise NotImplementedError
+
+    async def find_tracker(self, channel: int) -> dict:
+        raise NotImplementedError
+
+    async def save_tracker(self, document: dict):
+        raise NotImplementedError
+
+    async def delete_tracker(self, channel: int):
+        raise NotImplementedError
+
+
+def create_store(backend: str = STORAGE_BACKEND) -> CharacterStore:
+    # Backends are imported on demand so each only needs its own driver installed
+    if backend == "mongo":
+        from mongo_store import MongoStore
+
+        return MongoStore.connect()
+
+    if backend == "sqlite":
+        from sqlite_store import SqliteStore
+
+        return SqliteStore(STORAGE_PATH)
+
+    if backend == "memory":
+        from memory_store import MemoryStore
+
+        return MemoryStore()
+
+    raise ValueError(f"Unknown storage backend \"{backend}\".")
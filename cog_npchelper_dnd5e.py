@@ -1,19 +1,66 @@
+from __future__ import annotations
+
+import asyncio
+import io
 import os
+import random
+import re
+import time
+import traceback
 
 import d20
 import discord
 
 from discord.ext import commands
+from discord.ext.commands import CommandInvokeError
 from discord.message import Message
 from dotenv import load_dotenv
-from pymongo.collection import Collection
-from pymongo.database import Database
+
+import dice
+import metrics
+import scheduler
 
 from character import Character
+from character_cache import CharacterCache
+from character_store import CharacterStore, StoreNotReady
+from initiative_tracker import InitiativeTracker
+from outbox import Outbox, RollMessage
+from scheduler import BULK, UPDATE, Scheduler, guild_of
+from sheet_snapshot import export_characters, import_characters, is_export, snapshot_character
+from mass_roll import MASS_ROLL_MAX, list_creatures, roll_attacks, roll_d20
+from simulator import AttackModel, simulate, solve
 
 load_dotenv()
 DISCORD_ADMIN_ID = int(os.getenv("DISCORD_ADMIN_ID"))
 KEYWORD_LIST = ["adv", "dis"]
+UPDATE_PROGRESS_INTERVAL = 2.0
+
+# How long a command waits for the store to be prepared before giving up
+STORAGE_PREPARE_WAIT = float(os.getenv("STORAGE_PREPARE_WAIT", "10"))
+STORAGE_PREPARE_BACKOFF_MIN = 1.0
+STORAGE_PREPARE_BACKOFF_MAX = 60.0
+
+COUNT_PATTERN = re.compile(r"^x(\d+)$", re.IGNORECASE)
+DC_PATTERN = re.compile(r"^(.*?)(?:\s+dc\s*(\d+))?$", re.IGNORECASE)
+ARMOR_CLASS_PATTERN = re.compile(r"^(.*?)(?:\s+vs\.?\s+ac\s*(\d+))?$", re.IGNORECASE)
+
+SIMULATION_PATTERN = re.compile(r"^(.*?)\s+vs\.?\s+ac\s*(\d+)$", re.IGNORECASE)
+SIMULATION_TRIALS = 100000
+SIMULATION_MAX_TRIALS = 1000000
+SIMULATION_QUANTILES = [0.1, 0.5, 0.9]
+
+ACTIONS = ["check", "save", "attack", "initiative", "simulate"]
+
+# What the "*" actions read from each character
+ACTION_SECTIONS = {"check": ["abilities", "skills"], "save": ["saves"], "initiative": ["initiative"]}
+STATS_FAMILIES = [
+    ("Commands", "npchelper_command_seconds"), ("Actions", "npchelper_action_seconds"), ("Phases", "npchelper_phase_seconds"),
+    ("Queue waits", "npchelper_queue_wait_seconds")
+]
+STATS_ROWS = 8
+
+# Keep initiative order in Mongo so it survives a restart
+INITIATIVE_PERSIST = os.getenv("INITIATIVE_PERSIST", "0") == "1"
 
 
 def parse_arguments(args):
@@ -76,12 +123,91 @@ def with_article(noun: str) -> str:
 class Cog_NpcHelper_Dnd5e(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.mdb: Database = bot.mdb
-        self.characters: Collection = self.mdb.characters
+        self.store: CharacterStore = bot.store
+        self.scheduler: Scheduler = bot.scheduler
+        self.trackers: dict[int, InitiativeTracker] = {}
+        self.cache = CharacterCache(self.store)
+        self.outbox = Outbox()
+        self.prepared = asyncio.Event()
+        self.cache_watcher: asyncio.Task = None
+        self.initializer = self.bot.loop.create_task(self.initialize())
+
+    async def initialize(self):
+        # Commands and the cache watcher wait for the indexes and migrations, so an outage at startup is retried until it passes
+        backoff = 0.0
+
+        while True:
+            try:
+                await self.store.prepare()
+                break
+            except self.store.unavailable_errors as error:
+                backoff = min(max(backoff * 2, STORAGE_PREPARE_BACKOFF_MIN), STORAGE_PREPARE_BACKOFF_MAX)
+                print(f"Can't prepare the store, retrying in {backoff:.0f}s: {error!r}")
+            except Exception as error:
+                backoff = min(max(backoff * 2, STORAGE_PREPARE_BACKOFF_MIN), STORAGE_PREPARE_BACKOFF_MAX)
+                print(f"Preparing the store failed, retrying in {backoff:.0f}s: {error!r}")
+                traceback.print_exc()
+
+            await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+
+        self.prepared.set()
+        self.cache_watcher = self.bot.loop.create_task(self.cache.watch())
+
+    def cog_unload(self):
+        self.initializer.cancel()
+
+        if self.cache_watcher is not None:
+            self.cache_watcher.cancel()
+
+    async def cog_before_invoke(self, context: commands.Context):
+        context.started = time.perf_counter()
+
+        if not self.prepared.is_set():
+            try:
+                await asyncio.wait_for(self.prepared.wait(), timeout=STORAGE_PREPARE_WAIT)
+            except asyncio.TimeoutError:
+                raise CommandInvokeError(StoreNotReady())
+
+    async def cog_after_invoke(self, context: commands.Context):
+        # Runs for failed commands too, so errors and timeouts show up in the tail
+        elapsed = time.perf_counter() - context.started
+        metrics.histogram("npchelper_command_seconds", command=context.command.name).observe(elapsed)
+
+        labels = getattr(context, "metric_labels", None)
+
+        if labels is not None:
+            metrics.histogram("npchelper_action_seconds", **labels).observe(elapsed)
+
+    @commands.command(name="npcstats")
+    async def stats(self, context: commands.Context):
+        if context.author.id != DISCORD_ADMIN_ID:
+            await context.send("Error: Only the bot admin can see stats.")
+            return
+
+        sections = []
+
+        for title, name in STATS_FAMILIES:
+            rows = metrics.summarize(name)[:STATS_ROWS]
+
+            if len(rows) == 0:
+                continue
+
+            lines = [f"{'':<24}{'count':>7}{'mean':>8}{'p50':>8}{'p95':>8}{'p99':>8}"]
+            lines += [f"{labels[:24]:<24}{count:>7}{mean * 1000:>8.1f}{p50 * 1000:>8.1f}{p95 * 1000:>8.1f}{p99 * 1000:>8.1f}" for labels, count, mean, p50, p95, p99 in rows]
+            sections.append(f"**{title}** (ms, slowest p99 first)\n```\n" + "\n".join(lines) + "\n```")
+
+        if len(sections) == 0:
+            await context.send("No timings recorded yet.")
+            return
+
+        queues = ", ".join([f"{name} {waiting} waiting/{running} running" for name, (waiting, running) in self.scheduler.depths().items()])
+        sections.append(f"**Queues** {queues}")
+
+        await context.send("\n".join(sections)[:2000])
 
     @commands.command(name="npclist")
     async def list(self, context: commands.Context):
-        character_list = await Character.get_all(self.characters, context.channel.id)
+        character_list = await self.cache.get_all(context.channel.id, sections=[])
 
         if len(character_list) == 0:
             await context.send("No characters found in channel.")
@@ -92,17 +218,26 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
         await context.send(response)
 
     @commands.command(name="npcadd")
+    @scheduler.queue(UPDATE)
     async def add(self, context: commands.Context, url: str):
-        character = Character.create(self.characters, context.channel.id, url)
-        character.update()
-        await character.commit()
+        character = Character.create(self.store, context.channel.id, url, cache=self.cache)
+
+        # A sheet already added in another channel only needs its revision checked
+        await character.load_shared()
+
+        try:
+            await character.refresh()
+        except asyncio.TimeoutError:
+            await context.send("Error: Timed out while reading character sheet.")
+            return
         await context.send(f"Added {character.name} to channel.")
 
     @commands.command(name="npcremove")
+    @scheduler.queue(UPDATE)
     async def remove(self, context: commands.Context, *, name):
         print(name)
 
-        character = await Character.get(self.characters, context.channel.id, name, exact=True)
+        character = await self.cache.get(context.channel.id, name, exact=True)
 
         if character is None:
             await context.send(f"Error: Can't find character \"{name}\". Please make sure to type the exact name of the character, including capitalization.")
@@ -112,95 +247,326 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
         await context.send(f"{character.name} removed from channel.")
 
     @commands.command(name="npcupdate")
+    @scheduler.queue(UPDATE)
     async def update(self, context: commands.Context, name: str):
-        character = await Character.get(self.characters, context.channel.id, name)
+        if name == "*":
+            await self.update_all(context)
+            return
+
+        character = await self.cache.get(context.channel.id, name)
 
         if character is None:
             await context.send(f"Error: Can't find character \"{name}\".")
             return
 
         message: Message = await context.send(f"Updating {character.name}...")
-        character.update()
-        await character.commit()
-        await message.edit(content=f"Updated {character.name}.")
+
+        try:
+            changed = await character.refresh()
+        except asyncio.TimeoutError:
+            await message.edit(content=f"Error: Timed out while updating {character.name}.")
+            return
+
+        if changed:
+            await message.edit(content=f"Updated {character.name}.")
+        else:
+            await message.edit(content=f"{character.name} is already up to date.")
+
+    async def update_all(self, context: commands.Context):
+        # A copy, since each commit re-sorts the cached roster
+        character_list = list(await self.cache.get_all(context.channel.id))
+
+        if len(character_list) == 0:
+            await context.send("No characters found in channel.")
+            return
+
+        total = len(character_list)
+        message: Message = await context.send(f"Updating {total} characters...")
+
+        # Sheets are fetched concurrently; GoogleSheet throttles them to the API quota. Each character is
+        # written on its own, so one that another command is already refreshing joins that refresh instead.
+        # As bulk work, a large roster takes turns with other guilds' instead of filling every slot.
+        guild = guild_of(context)
+        updates = [asyncio.ensure_future(self.scheduler.run(BULK, guild, character.refresh)) for character in character_list]
+        pending = set(updates)
+
+        while pending:
+            _, pending = await asyncio.wait(pending, timeout=UPDATE_PROGRESS_INTERVAL)
+
+            if pending:
+                await message.edit(content=f"Updating characters... ({total - len(pending)}/{total})")
+
+        updated = []
+        unchanged = []
+        failed = []
+
+        for character, update in zip(character_list, updates):
+            if update.exception() is not None:
+                failed.append(character)
+            elif update.result():
+                updated.append(character)
+            else:
+                unchanged.append(character)
+
+        response = f"Updated {len(updated)} of {total} characters."
+
+        if len(unchanged) > 0:
+            response += f" {len(unchanged)} already up to date."
+
+        if len(failed) > 0:
+            response += "\nFailed to update: " + ", ".join([character.name for character in failed])
+
+        await message.edit(content=response)
+
+    @commands.command(name="npcexport")
+    @scheduler.queue(BULK)
+    async def export(self, context: commands.Context):
+        character_list = await self.cache.get_all(context.channel.id)
+
+        if len(character_list) == 0:
+            await context.send("No characters found in channel.")
+            return
+
+        data = export_characters(character_list)
+        await context.send(f"Exported {len(character_list)} characters.", file=discord.File(io.BytesIO(data), filename="characters.json.gz"))
+
+    @commands.command(name="npcimport")
+    @scheduler.queue(BULK)
+    async def import_(self, context: commands.Context):
+        attachments = context.message.attachments
+
+        if len(attachments) == 0:
+            await context.send("Error: Attach a character export or a sheet snapshot (JSON, CSV or XLSX).")
+            return
+
+        character_list = []
+
+        for attachment in attachments:
+            data = await attachment.read()
+
+            try:
+                if is_export(data, attachment.filename):
+                    character_list.extend(import_characters(data, attachment.filename, self.store, context.channel.id, cache=self.cache))
+                else:
+                    character_list.append(snapshot_character(data, attachment.filename, self.store, context.channel.id, cache=self.cache))
+            except (ValueError, KeyError, IndexError) as error:
+                await context.send(f"Error: Can't import \"{attachment.filename}\": {error}")
+                return
+
+        # Everything lands in one bulk write, so a failed file above leaves the channel untouched
+        await Character.commit_all(self.store, character_list)
+        await context.send(f"Imported {len(character_list)} characters: " + ", ".join([character.name for character in character_list]))
+
+    @commands.command(name="npcinit")
+    async def initiative(self, context: commands.Context, *command):
+        command_args, command_keywords, _ = parse_arguments(command)
+        action = command_args[0].lower() if len(command_args) > 0 else "start"
+
+        if "start".startswith(action):
+            character_list = await self.cache.get_all(context.channel.id, sections=ACTION_SECTIONS["initiative"])
+
+            if len(character_list) == 0:
+                await context.send("No characters found in channel.")
+                return
+
+            tracker = InitiativeTracker(context.channel.id)
+
+            for character in character_list:
+                roll, _ = self.initiative_roll(character, command_keywords)
+                tracker.add(character.name, roll.total, character.initiative.modifier)
+
+            tracker.message = await context.send(embed=tracker.to_embed())
+            tracker.message_id = tracker.message.id
+            self.trackers[context.channel.id] = tracker
+            await self.save_tracker(tracker)
+        elif "next".startswith(action) or "end".startswith(action):
+            tracker = await self.load_tracker(context.channel.id)
+
+            if tracker is None:
+                await context.send("Error: No initiative in progress in channel.")
+                return
+
+            if tracker.message is None:
+                tracker.message = await context.channel.fetch_message(tracker.message_id)
+
+            if "next".startswith(action):
+                tracker.advance()
+                await asyncio.gather(tracker.message.edit(embed=tracker.to_embed()), self.save_tracker(tracker))
+            else:
+                del self.trackers[context.channel.id]
+                await asyncio.gather(tracker.message.edit(embed=tracker.to_embed(ended=True)), self.delete_tracker(tracker))
+        else:
+            await context.send("Error: Unknown initiative action \"" + action + "\".")
+            return
+
+        await context.message.delete()
+
+    async def load_tracker(self, channel: int) -> InitiativeTracker:
+        tracker = self.trackers.get(channel)
+
+        if tracker is None and INITIATIVE_PERSIST:
+            tracker_dictionary = await self.store.find_tracker(channel)
+
+            if tracker_dictionary is not None:
+                tracker = InitiativeTracker.from_dict(tracker_dictionary)
+                self.trackers[channel] = tracker
+
+        return tracker
+
+    async def save_tracker(self, tracker: InitiativeTracker):
+        if not INITIATIVE_PERSIST:
+            return
+
+        await self.store.save_tracker(tracker.to_dict())
+
+    async def delete_tracker(self, tracker: InitiativeTracker):
+        if not INITIATIVE_PERSIST:
+            return
+
+        await self.store.delete_tracker(tracker.channel)
 
     @commands.command(name="npc")
     async def action(self, context, character_name, *command):
         if len(command) < 1:
             return
 
+        # A creature count like "x30" can go anywhere in the command
+        count = None
+
+        for i, argument in enumerate(command):
+            count_match = COUNT_PATTERN.match(argument)
+            if count_match is not None:
+                count = int(count_match.group(1))
+                command = command[:i] + command[i + 1:]
+                break
+
+        if len(command) < 1:
+            return
+
+        if count is not None and character_name == "*":
+            await context.send("Error: A creature count can't be combined with \"*\".")
+            return
+
+        if count is not None and count < 2:
+            await context.send("Error: A creature count must be at least 2.")
+            return
+
+        if count is None:
+            count = 1
+
         command_args, command_keywords, command_switches = parse_arguments(command)
 
         action = command_args[0].lower()
         key = " ".join(command_args[1:])
 
-        if character_name == "*":
-            character_list = await Character.get_all(self.characters, context.channel.id)
+        # Picked up by cog_after_invoke, so each action gets its own latency histogram
+        context.metric_labels = {
+            "action": next((name for name in ACTIONS if name.startswith(action)), "unknown"),
+            "target": "group" if count > 1 else "all" if character_name == "*" else "one"
+        }
+
+        if count > 1 and character_name != "*":
+            character = await self.cache.get(context.channel.id, character_name)
+
+            if character is None:
+                await context.send("Error: Can't find character \"" + character_name + "\".")
+                return
+
+            if count > MASS_ROLL_MAX:
+                await context.send(f"Error: Can't roll for more than {MASS_ROLL_MAX} creatures at once.")
+                return
+
+            if "check".startswith(action) or "save".startswith(action):
+                roll_message = self.roll_mass_test(character, action, key, count, command_keywords, command_switches)
+            elif "attack".startswith(action):
+                roll_message = self.roll_mass_attack(character, key, count, command_keywords, command_switches)
+            else:
+                await context.send("Error: Unknown action \"" + action + "\" for a group of creatures.")
+                return
+
+            await self.outbox.post(context, [roll_message], delete_invocation=True)
+        elif character_name == "*":
+            sections = next((ACTION_SECTIONS[name] for name in ACTION_SECTIONS if name.startswith(action)), [])
+            character_list = await self.cache.get_all(context.channel.id, sections=sections)
 
             if len(character_list) == 0:
                 await context.send("No characters found in channel.")
                 return
 
-            for character in character_list:
-                if "check".startswith(action):
-                    await self.execute_check(context, character, key, command_keywords, command_switches)
-                elif "save".startswith(action):
-                    await self.execute_save(context, character, key, command_keywords, command_switches)
-                elif "initiative".startswith(action):
-                    await self.execute_initiative(context, character, command_keywords, command_switches)
-                else:
-                    await context.send("Error: Unknown action \"" + action + "\".")
-                    return
+            # Roll everything locally first, then send the results together
+            if "check".startswith(action):
+                roll_messages = [self.roll_check(character, key, command_keywords, command_switches) for character in character_list]
+            elif "save".startswith(action):
+                roll_messages = [self.roll_save(character, key, command_keywords, command_switches) for character in character_list]
+            elif "initiative".startswith(action):
+                roll_messages = [self.roll_initiative(character, command_keywords, command_switches) for character in character_list]
+            else:
+                await context.send("Error: Unknown action \"" + action + "\".")
+                return
+
+            await self.outbox.post(context, roll_messages, delete_invocation=True)
         else:
-            character = await Character.get(self.characters, context.channel.id, character_name)
+            character = await self.cache.get(context.channel.id, character_name)
 
             if character is None:
                 await context.send("Error: Can't find character \"" + character_name + "\".")
                 return
 
             if "check".startswith(action):
-                result = await self.execute_check(context, character, key, command_keywords, command_switches)
+                await self.execute_check(context, character, key, command_keywords, command_switches)
             elif "save".startswith(action):
-                result = await self.execute_save(context, character, key, command_keywords, command_switches)
+                await self.execute_save(context, character, key, command_keywords, command_switches)
             elif "attack".startswith(action):
-                result = await self.execute_attack(context, character, key, command_keywords, command_switches)
+                await self.execute_attack(context, character, key, command_keywords, command_switches)
             elif "initiative".startswith(action):
-                result = await self.execute_initiative(context, character, command_keywords, command_switches)
+                await self.execute_initiative(context, character, command_keywords, command_switches)
+            elif "simulate".startswith(action):
+                await self.execute_simulate(context, character, key, command_keywords, command_switches)
             else:
                 await context.send("Error: Unknown action \"" + action + "\".")
                 return
 
-            if result is False:
-                return
+    async def execute_check(self, context, character: Character, check_name: str, keywords=[], switches={}):
+        return await self.outbox.post(context, [self.roll_check(character, check_name, keywords, switches)], delete_invocation=True)
 
-        await context.message.delete()
+    async def execute_save(self, context, character: Character, save_name: str, keywords=[], switches={}):
+        return await self.outbox.post(context, [self.roll_save(character, save_name, keywords, switches)], delete_invocation=True)
 
-    async def execute_check(self, context, character: Character, check_name: str, keywords=[], switches={}):
+    async def execute_initiative(self, context, character: Character, keywords=[], switches={}):
+        return await self.outbox.post(context, [self.roll_initiative(character, keywords, switches)], delete_invocation=True)
+
+    async def execute_attack(self, context: commands.Context, character: Character, attack_name, keywords=[], switches={}):
+        return await self.outbox.post(context, [self.roll_attack(character, attack_name, keywords, switches)], delete_invocation=True)
+
+    async def execute_simulate(self, context, character: Character, simulation: str, keywords=[], switches={}):
+        return await self.outbox.post(context, [self.roll_simulation(character, simulation, keywords, switches)], delete_invocation=True)
+
+    @metrics.traced("roll.check")
+    def roll_check(self, character: Character, check_name: str, keywords=[], switches={}) -> RollMessage:
         check = character.get_ability(check_name)
 
         if check is None:
             check = character.get_skill(check_name)
 
         if check is None:
-            await context.send(f"Error: Can't find check \"{check_name}\" for {character.name}.")
-            return False
+            return RollMessage(error=f"Error: Can't find check \"{check_name}\" for {character.name}.")
 
         keywords = keywords.copy()
-        keywords.extend(check["keywords"])
+        keywords.extend(check.keyword_list())
 
         advantage = parse_advantage(keywords)
         if advantage > 0:
-            dice = "2d20kh1"
+            check_dice = "2d20kh1"
         elif advantage < 0:
-            dice = "2d20kl1"
+            check_dice = "2d20kl1"
         else:
-            dice = "1d20"
+            check_dice = "1d20"
 
-        dice += "+" + str(check["modifier"])
-        roll = d20.roll(dice)
+        check_dice += "+" + str(check.modifier)
+        roll = dice.roll(check_dice)
 
         embed = discord.Embed()
-        embed.title = f"{character.name} makes {with_article(check['name'])} check!"
+        embed.title = f"{character.name} makes {with_article(check.name)} check!"
         embed.description = str(roll)
         embed.color = 0x00ff00
 
@@ -212,38 +578,31 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
         elif advantage < 0:
             embed.description = "`Disadvantage`\n" + embed.description
 
-        sent_message: discord.Message = await context.send(embed=embed)
+        return RollMessage(embed=embed, critical_hit=roll.crit == d20.dice.CritType.CRIT, critical_miss=roll.crit == d20.dice.CritType.FAIL)
 
-        if roll.crit == d20.dice.CritType.CRIT:
-            await sent_message.add_reaction("\U00002764")
-        elif roll.crit == d20.dice.CritType.FAIL:
-            await sent_message.add_reaction("\U0001F622")
-
-        return True
-
-    async def execute_save(self, context, character: Character, save_name: str, keywords=[], switches={}):
+    @metrics.traced("roll.save")
+    def roll_save(self, character: Character, save_name: str, keywords=[], switches={}) -> RollMessage:
         save = character.get_save(save_name)
 
         if save is None:
-            await context.send(f"Error: Can't find save \"{save_name}\" for {character.name}.")
-            return False
+            return RollMessage(error=f"Error: Can't find save \"{save_name}\" for {character.name}.")
 
         keywords = keywords.copy()
-        keywords.extend(save["keywords"])
+        keywords.extend(save.keyword_list())
 
         advantage = parse_advantage(keywords)
         if advantage > 0:
-            dice = "2d20kh1"
+            save_dice = "2d20kh1"
         elif advantage < 0:
-            dice = "2d20kl1"
+            save_dice = "2d20kl1"
         else:
-            dice = "1d20"
+            save_dice = "1d20"
 
-        dice += "+" + str(save["modifier"])
-        roll = d20.roll(dice)
+        save_dice += "+" + str(save.modifier)
+        roll = dice.roll(save_dice)
 
         embed = discord.Embed()
-        embed.title = f"{character.name} makes {with_article(save['name'])} save!"
+        embed.title = f"{character.name} makes {with_article(save.name)} save!"
         embed.description = str(roll)
         embed.color = 0x0000ff
 
@@ -255,29 +614,11 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
         elif advantage < 0:
             embed.description = "`Disadvantage`\n" + embed.description
 
-        sent_message: discord.Message = await context.send(embed=embed)
-
-        if roll.crit == d20.dice.CritType.CRIT:
-            await sent_message.add_reaction("\U00002764")
-        elif roll.crit == d20.dice.CritType.FAIL:
-            await sent_message.add_reaction("\U0001F622")
+        return RollMessage(embed=embed, critical_hit=roll.crit == d20.dice.CritType.CRIT, critical_miss=roll.crit == d20.dice.CritType.FAIL)
 
-        return True
-
-    async def execute_initiative(self, context, character: Character, keywords=[], switches={}):
-        keywords = keywords.copy()
-        keywords.extend(character.initiative["keywords"])
-
-        advantage = parse_advantage(keywords)
-        if advantage > 0:
-            dice = "2d20kh1"
-        elif advantage < 0:
-            dice = "2d20kl1"
-        else:
-            dice = "1d20"
-
-        dice += "+" + str(character.initiative["modifier"])
-        roll = d20.roll(dice)
+    @metrics.traced("roll.initiative")
+    def roll_initiative(self, character: Character, keywords=[], switches={}) -> RollMessage:
+        roll, advantage = self.initiative_roll(character, keywords)
 
         embed = discord.Embed()
         embed.title = f"{character.name} rolls for initiative!"
@@ -292,16 +633,29 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
         elif advantage < 0:
             embed.description = "`Disadvantage`\n" + embed.description
 
-        await context.send(embed=embed)
+        return RollMessage(embed=embed)
 
-        return True
+    def initiative_roll(self, character: Character, keywords=[]):
+        keywords = keywords.copy()
+        keywords.extend(character.initiative.keyword_list())
 
-    async def execute_attack(self, context: commands.Context, character: Character, attack_name, keywords=[], switches={}):
+        advantage = parse_advantage(keywords)
+        if advantage > 0:
+            initiative_dice = "2d20kh1"
+        elif advantage < 0:
+            initiative_dice = "2d20kl1"
+        else:
+            initiative_dice = "1d20"
+
+        initiative_dice += "+" + str(character.initiative.modifier)
+        return dice.roll(initiative_dice), advantage
+
+    @metrics.traced("roll.attack")
+    def roll_attack(self, character: Character, attack_name, keywords=[], switches={}) -> RollMessage:
         attack_list = character.get_attacks(attack_name)
 
         if attack_list is None:
-            await context.send(f"Error: Can't find attack \"{attack_name}\" for {character.name}.")
-            return False
+            return RollMessage(error=f"Error: Can't find attack \"{attack_name}\" for {character.name}.")
 
         embed_title = ""
         embed_description = ""
@@ -311,8 +665,8 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
 
         if len(attack_list) == 1:
             attack = attack_list[0]
-            embed_title = f"{character.name} attacks with {with_article(attack['name'])}!"
-            embed_description, critical_hit, critical_miss = await self.execute_attack_single(character, attack, keywords=keywords, switches=switches)
+            embed_title = f"{character.name} attacks with {with_article(attack.name)}!"
+            embed_description, critical_hit, critical_miss = self.execute_attack_single(character, attack, keywords=keywords, switches=switches)
         else:
             embed_title = f"{character.name} executes a multi-attack!"
             embed_description = ""
@@ -320,7 +674,7 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
             critical_miss = False
 
             for attack in attack_list:
-                attack_description, critical_hit_one, critical_miss_one = await self.execute_attack_single(character, attack, include_name=True, keywords=keywords, switches=switches)
+                attack_description, critical_hit_one, critical_miss_one = self.execute_attack_single(character, attack, include_name=True, keywords=keywords, switches=switches)
                 embed_description += attack_description + "\n"
                 critical_hit |= critical_hit_one
                 critical_miss |= critical_miss_one
@@ -339,19 +693,180 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
         elif advantage < 0:
             embed.description = "`Disadvantage`\n" + embed.description
 
-        sent_message: discord.Message = await context.send(embed=embed)
+        return RollMessage(embed=embed, critical_hit=critical_hit, critical_miss=critical_miss)
 
-        if critical_hit:
-            await sent_message.add_reaction("\U00002764")
+    @metrics.traced("roll.simulation")
+    def roll_simulation(self, character: Character, simulation: str, keywords=[], switches={}) -> RollMessage:
+        match = SIMULATION_PATTERN.match(simulation)
+
+        if match is None:
+            return RollMessage(error="Error: Usage is \"!npc <name> simulate <attack> vs AC <number>\".")
+
+        attack_name = match.group(1)
+        armor_class = int(match.group(2))
+        attack_list = character.get_attacks(attack_name)
+
+        if attack_list is None:
+            return RollMessage(error=f"Error: Can't find attack \"{attack_name}\" for {character.name}.")
+
+        try:
+            models = [AttackModel(attack, character.system, armor_class, parse_advantage(keywords + attack.keyword_list()), switches) for attack in attack_list]
+
+            if switches.get("mode") == "exact":
+                result = solve(models, SIMULATION_QUANTILES)
+                footer = "Exact distribution"
+            else:
+                trials = int(switches.get("trials", SIMULATION_TRIALS))
 
-        if critical_miss:
-            await sent_message.add_reaction("\U0001F622")
+                if trials < 1:
+                    raise ValueError("The number of trials must be at least 1.")
 
-        return True
+                trials = min(trials, SIMULATION_MAX_TRIALS)
+                result = simulate(models, trials, SIMULATION_QUANTILES)
+                footer = f"{trials:,} trials"
+        except ValueError as error:
+            return RollMessage(error=f"Error: {error}")
 
-    async def execute_attack_single(self, character: Character, attack, include_name=False, keywords=[], switches={}):
+        embed = discord.Embed()
+
+        if len(attack_list) == 1:
+            embed.title = f"{character.name} simulates {with_article(attack_list[0].name)} against AC {armor_class}!"
+        else:
+            embed.title = f"{character.name} simulates a multi-attack against AC {armor_class}!"
+
+        embed.description = ""
+
+        for attack, (hit_chance, crit_chance) in zip(attack_list, result.chances):
+            embed.description += f"**{attack.name}**: {hit_chance:.1%} to hit, {crit_chance:.1%} to crit\n"
+
+        low, median, high = result.percentiles
+        embed.description += f"\n**Damage**: {result.mean:.1f} average, {median:g} median, {low:g}\u2013{high:g} middle 80%"
+        embed.color = 0x8800ff
+        embed.set_footer(text=footer)
+
+        if character.portrait:
+            embed.set_thumbnail(url=character.portrait)
+
+        advantage = parse_advantage(keywords)
+        if advantage > 0:
+            embed.description = "`Advantage`\n" + embed.description
+        elif advantage < 0:
+            embed.description = "`Disadvantage`\n" + embed.description
+
+        return RollMessage(embed=embed)
+
+    @metrics.traced("roll.mass_test")
+    def roll_mass_test(self, character: Character, action: str, test: str, count: int, keywords=[], switches={}) -> RollMessage:
+        match = DC_PATTERN.match(test)
+        test_name = match.group(1)
+        dc = int(match.group(2)) if match.group(2) is not None else None
+
+        if "check".startswith(action):
+            stat = character.get_ability(test_name)
+
+            if stat is None:
+                stat = character.get_skill(test_name)
+
+            kind = "check"
+        else:
+            stat = character.get_save(test_name)
+            kind = "save"
+
+        if stat is None:
+            return RollMessage(error=f"Error: Can't find {kind} \"{test_name}\" for {character.name}.")
+
+        advantage = parse_advantage(keywords + stat.keyword_list())
+        naturals = roll_d20(count, advantage)
+        totals = naturals + stat.modifier
+
+        embed = discord.Embed()
+        embed.title = f"{character.name} \u00d7{count} make {with_article(stat.name)} {kind}!"
+        embed.description = ""
+        embed.color = 0x00ff00 if kind == "check" else 0x0000ff
+
+        if dc is not None:
+            successes = int((totals >= dc).sum())
+            embed.description += f"**DC {dc}**: {successes} succeed, {count - successes} fail\n"
+
+        embed.description += f"**Totals**: {totals.min()}\u2013{totals.max()}, {totals.mean():.1f} average\n"
+
+        if (naturals == 20).any():
+            embed.description += f"**Natural 20**: {list_creatures(naturals == 20)}\n"
+
+        if (naturals == 1).any():
+            embed.description += f"**Natural 1**: {list_creatures(naturals == 1)}\n"
+
+        if character.portrait:
+            embed.set_thumbnail(url=character.portrait)
+
+        if advantage > 0:
+            embed.description = "`Advantage`\n" + embed.description
+        elif advantage < 0:
+            embed.description = "`Disadvantage`\n" + embed.description
+
+        return RollMessage(embed=embed, critical_hit=bool((naturals == 20).any()), critical_miss=bool((naturals == 1).any()))
+
+    @metrics.traced("roll.mass_attack")
+    def roll_mass_attack(self, character: Character, attack_text: str, count: int, keywords=[], switches={}) -> RollMessage:
+        match = ARMOR_CLASS_PATTERN.match(attack_text)
+        attack_name = match.group(1)
+        armor_class = int(match.group(2)) if match.group(2) is not None else None
+
+        attack_list = character.get_attacks(attack_name)
+
+        if attack_list is None:
+            return RollMessage(error=f"Error: Can't find attack \"{attack_name}\" for {character.name}.")
+
+        try:
+            # Without an AC, everything but a natural 1 hits, as with single attacks
+            models = [AttackModel(attack, character.system, armor_class if armor_class is not None else -100, parse_advantage(keywords + attack.keyword_list()), switches) for attack in attack_list]
+        except ValueError as error:
+            return RollMessage(error=f"Error: {error}")
+
+        results = roll_attacks(models, count)
+
+        embed = discord.Embed()
+
+        if len(attack_list) == 1:
+            embed.title = f"{character.name} \u00d7{count} attack with {with_article(attack_list[0].name)}!"
+        else:
+            embed.title = f"{character.name} \u00d7{count} execute a multi-attack!"
+
+        embed.description = ""
+        embed.color = 0xff0000
+
+        total_damage = 0
+        critical_hit = False
+
+        for attack, (hits, crits, damage) in zip(attack_list, results):
+            hit_count = int(hits.sum())
+            embed.description += f"**{attack.name}**: {hit_count} hit, {count - hit_count} miss, {int(damage.sum())} damage\n"
+
+            if crits.any():
+                embed.description += f"**Critical hits**: {list_creatures(crits)}\n"
+                critical_hit = True
+
+            total_damage += int(damage.sum())
+
+        if armor_class is not None:
+            embed.description += f"\n**Total damage against AC {armor_class}**: {total_damage}"
+        else:
+            embed.description += f"\n**Total damage**: {total_damage}"
+
+        if character.portrait:
+            embed.set_thumbnail(url=character.portrait)
+
+        advantage = parse_advantage(keywords)
+        if advantage > 0:
+            embed.description = "`Advantage`\n" + embed.description
+        elif advantage < 0:
+            embed.description = "`Disadvantage`\n" + embed.description
+
+        return RollMessage(embed=embed, critical_hit=critical_hit)
+
+    def execute_attack_single(self, character: Character, attack, include_name=False, keywords=[], switches={}):
         keywords = keywords.copy()
-        keywords.extend(attack["keywords"])
+        keywords.extend(attack.keyword_list())
 
         if character.system == "dnd5":
             return self.execute_attack_single_5e(character, attack, include_name, keywords, switches)
@@ -368,8 +883,8 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
         else:
             hit_dice = "1d20"
 
-        hit_dice += "+" + str(attack["hit"])
-        hit_roll = d20.roll(hit_dice)
+        hit_dice += "+" + str(attack.hit)
+        hit_roll = dice.roll(hit_dice)
 
         # Check for critical hit
         critical_hit = False
@@ -377,27 +892,20 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
 
         # Critical if roll is a natural 20 or above threat threshold
         d20_value = d20.utils.leftmost(hit_roll.expr).total
-        if (hit_roll.crit == d20.dice.CritType.CRIT) or (d20_value >= attack["critrange"]):
+        if (hit_roll.crit == d20.dice.CritType.CRIT) or (d20_value >= attack.critrange):
             critical_hit = True
         elif d20_value == 1:
             critical_miss = True
 
-        # Roll for damage
-        damage_dice = attack["damage"]
-
-        if critical_hit:
-            # Double leftmost dice
-            dice_parts = damage_dice.split("d", 1)
-            dice_parts[0] = str(int(dice_parts[0]) * 2)
-            damage_dice = "d".join(dice_parts)
-
-        damage_roll = d20.roll(damage_dice)
+        # Roll for damage, leftmost dice doubled on a critical hit
+        damage_dice = attack.crit_damage if critical_hit else attack.damage
+        damage_roll = dice.roll(damage_dice)
 
         # Build attack text
         attack_text = ""
 
         if include_name:
-            attack_text += f"**{attack['name']}**\n"
+            attack_text += f"**{attack.name}**\n"
 
         attack_text += f"**To Hit**: {str(hit_roll)}\n"
 
@@ -425,12 +933,12 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
             bonus_damage += power_attack_damage
 
         # Roll to hit
-        hit_dice = f"1d20+{attack['hit']}"
+        hit_dice = f"1d20+{attack.hit}"
 
         if bonus_attack != 0:
             hit_dice += f"+{bonus_attack}"
 
-        hit_roll = d20.roll(hit_dice)
+        hit_roll = dice.roll(hit_dice)
 
         # Check for critical hit
         critical_hit = False
@@ -439,26 +947,26 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
 
         # Critical if roll is above threat threshold, also confirm
         d20_value = d20.utils.leftmost(hit_roll.expr).total
-        if d20_value >= attack["critrange"]:
+        if d20_value >= attack.critrange:
             critical_hit = True
-            confirm_roll = d20.roll(hit_dice)
+            confirm_roll = dice.roll(hit_dice)
         elif d20_value == 1:
             critical_miss = True
-            confirm_roll = d20.roll(hit_dice)
+            confirm_roll = dice.roll(hit_dice)
 
         # Roll for damage
-        damage_dice = attack["damage"]
+        damage_dice = attack.damage
 
         if bonus_damage != 0:
             damage_dice += f"+{bonus_damage}"
 
-        damage_roll = d20.roll(damage_dice)
+        damage_roll = dice.roll(damage_dice)
 
         # Build attack text
         attack_text = ""
 
         if include_name:
-            attack_text += f"**{attack['name']}**\n"
+            attack_text += f"**{attack.name}**\n"
 
         attack_text += "**To Hit**: " + str(hit_roll) + "\n"
 
@@ -474,7 +982,7 @@ class Cog_NpcHelper_Dnd5e(commands.Cog):
             attack_text += f"**Damage**: {str(damage_roll)}\n"
 
         if critical_hit:
-            damage_critical = damage_roll.total * attack["critmultiplier"]
+            damage_critical = damage_roll.total * attack.critmultiplier
             attack_text += f"**Critical Damage**: `{str(damage_critical)}`\n"
 
         for extra in extra_text:
@@ -0,0 +1,173 @@
+import os
+
+from discord.ext import commands
+from discord.ext.commands import CommandInvokeError
+from dotenv import load_dotenv
+
+from interaction import APPLICATION_COMMAND, APPLICATION_COMMAND_AUTOCOMPLETE, InteractionContext, InteractionRoute, autocomplete
+from name_index import MAX_CHOICES
+from scheduler import INTERACTIVE, guild_of
+
+load_dotenv()
+SLASH_COMMANDS = os.getenv("SLASH_COMMANDS", "1") == "1"
+
+# Global commands can take an hour to show up everywhere; guild commands update at once, for testing
+SLASH_COMMAND_GUILDS = [int(guild) for guild in os.getenv("SLASH_COMMAND_GUILDS", "").split(",") if guild.strip()]
+
+# Option types from the Discord API
+STRING = 3
+
+CHARACTER_OPTION = {"type": STRING, "name": "character", "description": "Character name", "required": True, "autocomplete": True}
+
+COMMANDS = [
+    {
+        "name": "npc",
+        "description": "Roll for a character",
+        "options": [
+            dict(CHARACTER_OPTION, description="Character name, or * for everyone in the channel"),
+            {
+                "type": STRING, "name": "action", "description": "What to roll", "required": True,
+                "choices": [{"name": name, "value": name} for name in ["check", "save", "attack", "initiative", "simulate"]]
+            },
+            {"type": STRING, "name": "target", "description": "Check, save or attack name", "required": False, "autocomplete": True},
+            {"type": STRING, "name": "options", "description": "Anything else, as typed after !npc, like adv x4 -b 2 or vs AC 15", "required": False}
+        ]
+    },
+    {
+        "name": "npcupdate",
+        "description": "Reload a character from its sheet",
+        "options": [dict(CHARACTER_OPTION, description="Character name, or * for everyone in the channel")]
+    },
+    {
+        "name": "npcremove",
+        "description": "Remove a character from the channel",
+        "options": [CHARACTER_OPTION]
+    }
+]
+
+
+class Cog_SlashCommands(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.registered = False
+
+        # Channels being loaded for autocomplete, so a burst of keystrokes loads each once
+        self.warming = set()
+
+    @property
+    def npchelper(self):
+        return self.bot.get_cog("Cog_NpcHelper_Dnd5e")
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if not SLASH_COMMANDS or self.registered:
+            return
+
+        self.registered = True
+        application_id = self.bot.user.id
+
+        if len(SLASH_COMMAND_GUILDS) == 0:
+            await self.bot.http.request(InteractionRoute("PUT", "/applications/{application_id}/commands", application_id=application_id), json=COMMANDS)
+            return
+
+        for guild in SLASH_COMMAND_GUILDS:
+            await self.bot.http.request(
+                InteractionRoute("PUT", "/applications/{application_id}/guilds/{guild_id}/commands", application_id=application_id, guild_id=guild),
+                json=COMMANDS
+            )
+
+    # discord.py 1.7 doesn't parse interactions, so they're picked out of the raw gateway events
+    @commands.Cog.listener()
+    async def on_socket_response(self, message: dict):
+        if message.get("t") != "INTERACTION_CREATE":
+            return
+
+        interaction = message["d"]
+
+        if interaction["type"] == APPLICATION_COMMAND_AUTOCOMPLETE:
+            await self.complete(interaction)
+        elif interaction["type"] == APPLICATION_COMMAND:
+            await self.invoke(interaction)
+
+    # Autocomplete, answered from the cache's name index without touching the store
+
+    async def complete(self, interaction: dict):
+        options = interaction["data"].get("options", [])
+        values = {option["name"]: option.get("value", "") for option in options}
+        focused = next((option for option in options if option.get("focused")), None)
+        channel = int(interaction["channel_id"])
+        names = self.npchelper.cache.names
+
+        if not names.has(channel):
+            self.warm(channel)
+
+        if focused is None:
+            choices = []
+        elif focused["name"] == "character":
+            choices = names.names(channel, focused["value"])
+
+            if interaction["data"]["name"] != "npcremove" and "*".startswith(focused["value"]):
+                choices = ["*"] + choices[:MAX_CHOICES - 1]
+        else:
+            choices = names.targets(channel, values.get("character", ""), values.get("action", ""), focused["value"])
+
+        await autocomplete(self.bot.http, interaction, choices)
+
+    def warm(self, channel: int):
+        # The first keystroke in a cold channel gets no choices, but loads the channel for the next ones
+        if channel in self.warming:
+            return
+
+        self.warming.add(channel)
+        task = self.bot.loop.create_task(self.npchelper.cache.get_all(channel))
+        task.add_done_callback(lambda _: self.warming.discard(channel))
+
+    # Commands, run by the text commands' code with the interaction standing in for the message
+
+    async def invoke(self, interaction: dict):
+        name = interaction["data"]["name"]
+        values = {option["name"]: option.get("value", "") for option in interaction["data"].get("options", [])}
+        cog = self.npchelper
+        context = InteractionContext(self.bot, interaction, name)
+
+        if name == "npc":
+            command = cog.action
+            arguments = [values["character"], values["action"]] + ([values["target"]] if values.get("target") else []) + values.get("options", "").split()
+        elif name == "npcupdate":
+            command = cog.update
+            arguments = [values["character"]]
+        elif name == "npcremove":
+            command = cog.remove
+            arguments = [values["character"]]
+        else:
+            return
+
+        # Updates read sheets and always take a while; anything else is deferred only if it runs late
+        if name == "npcupdate":
+            await context.defer()
+        else:
+            context.watch()
+
+        try:
+            queue = getattr(command.callback, "__scheduler_queue__", INTERACTIVE)
+            await self.bot.scheduler.run(queue, guild_of(context), self.run, cog, command, context, arguments)
+        except Exception as error:
+            # Store outages and write conflicts get the same answers as text commands, which don't wrap command errors either
+            self.bot.dispatch("command_error", context, error if isinstance(error, commands.CommandError) else CommandInvokeError(error))
+        finally:
+            await context.finish()
+
+    async def run(self, cog, command: commands.Command, context: InteractionContext, arguments: list[str]):
+        await cog.cog_before_invoke(context)
+
+        try:
+            if command is cog.remove:
+                await command.callback(cog, context, name=arguments[0])
+            else:
+                await command.callback(cog, context, *arguments)
+        finally:
+            await cog.cog_after_invoke(context)
+
+
+def setup(bot):
+    bot.add_cog(Cog_SlashCommands(bot))
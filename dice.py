@@ -0,0 +1,25 @@
+import d20
+
+# d20's Roller keeps its own cache of parsed expressions, so every roll shares this one
+roller = d20.Roller()
+
+
+def roll(expression: str) -> d20.RollResult:
+    return roller.roll(expression)
+
+
+def double_dice(expression: str) -> str:
+    # Double leftmost dice, as a 5e critical hit does
+    dice_parts = expression.split("d", 1)
+
+    if len(dice_parts) < 2:
+        return expression
+
+    if dice_parts[0] == "":
+        dice_parts[0] = "1"
+
+    if not dice_parts[0].isdigit():
+        return expression
+
+    dice_parts[0] = str(int(dice_parts[0]) * 2)
+    return "d".join(dice_parts)
@@ -1,8 +1,31 @@
+import asyncio
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
 import gspread
 
+from dotenv import load_dotenv
+
+import metrics
+
+from rate_limit import TokenBucket
+
+load_dotenv()
+SHEETS_MAX_CONCURRENCY = int(os.getenv("SHEETS_MAX_CONCURRENCY", "4"))
+SHEETS_TIMEOUT = float(os.getenv("SHEETS_TIMEOUT", "30"))
+
+# Default read quota is 60 requests per minute per user; leave room for the burst
+SHEETS_REQUESTS_PER_MINUTE = float(os.getenv("SHEETS_REQUESTS_PER_MINUTE", "50"))
+SHEETS_BURST = float(os.getenv("SHEETS_BURST", "10"))
+
 
 class GoogleSheet:
     _service = None
+    _transport = None
+    _executor = None
+    _semaphore = None
+    _bucket = TokenBucket(SHEETS_REQUESTS_PER_MINUTE / 60, SHEETS_BURST)
 
     @staticmethod
     def get_service():
@@ -10,3 +33,108 @@ class GoogleSheet:
             GoogleSheet._service = gspread.service_account(filename="client_secret.json")
 
         return GoogleSheet._service
+
+    @staticmethod
+    def get_transport():
+        if GoogleSheet._transport is None:
+            GoogleSheet._transport = GspreadTransport()
+
+        return GoogleSheet._transport
+
+    @staticmethod
+    def set_transport(transport):
+        GoogleSheet._transport = transport
+
+    @staticmethod
+    def batch_get(sheet_id: str, ranges: list) -> dict:
+        response = GoogleSheet.get_transport().batch_get(sheet_id, ranges)
+
+        # Value ranges come back in request order; empty ranges have no "values" key
+        values = {}
+
+        for range_name, value_range in zip(ranges, response.get("valueRanges", [])):
+            values[range_name] = value_range.get("values", [])
+
+        return values
+
+    @staticmethod
+    def modified_time(sheet_id: str) -> str:
+        return GoogleSheet.get_transport().modified_time(sheet_id)
+
+    @staticmethod
+    async def run(function, *args, quota: bool = True):
+        # Blocking gspread calls run on a bounded thread pool so the event loop keeps serving commands
+        if GoogleSheet._executor is None:
+            GoogleSheet._executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_CONCURRENCY, thread_name_prefix="google_sheet")
+
+        if GoogleSheet._semaphore is None:
+            GoogleSheet._semaphore = asyncio.Semaphore(SHEETS_MAX_CONCURRENCY)
+
+        if quota:
+            with metrics.span("sheet.quota_wait"):
+                await GoogleSheet._bucket.acquire()
+
+        with metrics.span("sheet.pool_wait"):
+            await GoogleSheet._semaphore.acquire()
+
+        loop = asyncio.get_running_loop()
+        semaphore = GoogleSheet._semaphore
+
+        try:
+            future = GoogleSheet._executor.submit(function, *args)
+        except BaseException:
+            semaphore.release()
+            raise
+
+        # A timed out call keeps its thread until the request returns, so the slot is only freed then
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(semaphore.release))
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=SHEETS_TIMEOUT)
+
+
+class GspreadTransport:
+    def __init__(self):
+        self.request_count = 0
+
+    def batch_get(self, sheet_id: str, ranges: list) -> dict:
+        # Named ranges are workbook-wide, so a single values:batchGet covers every one of them
+        response = self._request(
+            "get",
+            gspread.urls.SPREADSHEET_VALUES_BATCH_URL % sheet_id,
+            params={"ranges": ranges, "majorDimension": "ROWS"}
+        )
+        self.request_count += 1
+
+        return response.json()
+
+    def modified_time(self, sheet_id: str) -> str:
+        response = self._request(
+            "get",
+            f"{gspread.urls.DRIVE_FILES_API_V3_URL}/{sheet_id}",
+            params={"fields": "modifiedTime", "supportsAllDrives": True}
+        )
+
+        return response.json().get("modifiedTime")
+
+    @staticmethod
+    def _request(method: str, url: str, params: dict):
+        # gspread 6 moved raw requests from the client to its HTTP client
+        client = GoogleSheet.get_service()
+        return getattr(client, "http_client", client).request(method, url, params=params)
+
+
+class RecordedTransport:
+    def __init__(self, responses: dict, revisions: dict = {}):
+        self.responses = responses
+        self.revisions = revisions
+        self.request_count = 0
+
+    def modified_time(self, sheet_id: str) -> str:
+        return self.revisions.get(sheet_id)
+
+    def batch_get(self, sheet_id: str, ranges: list) -> dict:
+        self.request_count += 1
+
+        if sheet_id not in self.responses:
+            raise KeyError(f"No recorded response for sheet \"{sheet_id}\"")
+
+        return self.responses[sheet_id]
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import discord
+
+
+class InitiativeEntry:
+    __slots__ = ("name", "total", "modifier")
+
+    def __init__(self, name: str, total: int, modifier: int):
+        self.name = name
+        self.total = total
+        self.modifier = modifier
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "total": self.total,
+            "modifier": self.modifier
+        }
+
+    @classmethod
+    def from_dict(cls, dct) -> InitiativeEntry:
+        return cls(dct["name"], dct["total"], dct["modifier"])
+
+
+class InitiativeTracker:
+    def __init__(self, channel: int):
+        self.channel = channel
+        self.entries: list[InitiativeEntry] = []
+        self.turn = 0
+        self.round = 1
+        self.message_id: int = None
+        self.message: discord.Message = None
+
+    def add(self, name: str, total: int, modifier: int):
+        self.entries.append(InitiativeEntry(name, total, modifier))
+
+        # Highest total acts first; ties go to the higher modifier, then by name
+        self.entries.sort(key=lambda entry: (-entry.total, -entry.modifier, entry.name))
+
+    def advance(self):
+        if len(self.entries) == 0:
+            return
+
+        self.turn += 1
+
+        if self.turn >= len(self.entries):
+            self.turn = 0
+            self.round += 1
+
+    def current(self) -> InitiativeEntry:
+        if len(self.entries) == 0:
+            return None
+
+        return self.entries[self.turn]
+
+    def to_embed(self, ended: bool = False) -> discord.Embed:
+        lines = []
+
+        for i, entry in enumerate(self.entries):
+            if i == self.turn and not ended:
+                lines.append(f"\u25B6 **{entry.total}** \u2022 **{entry.name}**")
+            else:
+                lines.append(f"\u2003 {entry.total} \u2022 {entry.name}")
+
+        embed = discord.Embed()
+        embed.title = f"Initiative \u2022 Round {self.round}"
+        embed.description = "\n".join(lines)
+        embed.color = 0xff8800
+
+        if ended:
+            embed.set_footer(text="Combat ended.")
+        elif len(self.entries) > 0:
+            embed.set_footer(text=f"{self.current().name}'s turn")
+
+        return embed
+
+    # Serialization
+
+    def to_dict(self) -> dict:
+        return {
+            "channel": str(self.channel),
+            "entries": [entry.to_dict() for entry in self.entries],
+            "turn": self.turn,
+            "round": self.round,
+            "message": self.message_id
+        }
+
+    @classmethod
+    def from_dict(cls, dct) -> InitiativeTracker:
+        tracker = cls(int(dct["channel"]))
+
+        tracker.entries = [InitiativeEntry.from_dict(entry) for entry in dct["entries"]]
+        tracker.turn = dct["turn"]
+        tracker.round = dct["round"]
+        tracker.message_id = dct["message"]
+
+        return tracker
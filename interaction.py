@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import asyncio
+import os
+
+from types import SimpleNamespace
+
+import discord
+
+from discord.http import Route
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Interactions have to be answered within three seconds; anything slower is deferred before that
+INTERACTION_DEFER_AFTER = float(os.getenv("INTERACTION_DEFER_AFTER", "2.0"))
+
+# Interaction types and callback types from the Discord API
+APPLICATION_COMMAND = 2
+APPLICATION_COMMAND_AUTOCOMPLETE = 4
+CHANNEL_MESSAGE = 4
+DEFERRED_CHANNEL_MESSAGE = 5
+AUTOCOMPLETE_RESULT = 8
+
+# Webhook message id of the interaction's own reply
+ORIGINAL = "@original"
+
+
+# discord.py 1.7 targets API v7, which predates application commands
+class InteractionRoute(Route):
+    BASE = "https://discord.com/api/v10"
+
+
+def message_payload(content: str = None, embed: discord.Embed = None, embeds: list[discord.Embed] = None) -> dict:
+    if embed is not None:
+        embeds = [embed]
+
+    payload = {"content": content}
+
+    if embeds is not None:
+        payload["embeds"] = [embed.to_dict() for embed in embeds]
+
+    return payload
+
+
+class InteractionMessage:
+    def __init__(self, context: InteractionContext, message_id: str, channel_id: int):
+        self._context = context
+        self.id = message_id
+        self.channel_id = channel_id
+
+    async def edit(self, content: str = None, embed: discord.Embed = None, embeds: list[discord.Embed] = None):
+        await self._context.edit(self.id, message_payload(content, embed, embeds))
+
+    async def add_reaction(self, emoji: str):
+        # Reactions need the real message id, which the reply to an interaction doesn't come with
+        if self.id == ORIGINAL:
+            self.id = await self._context.original_id()
+
+        await self._context.http.add_reaction(self.channel_id, self.id, emoji)
+
+    async def delete(self):
+        await self._context.http.request(self._context.message_route("DELETE", self.id))
+
+
+# Stands in for commands.Context, so the cog's commands answer a slash command the same way they answer a message.
+# The first send answers the interaction, or fills in its deferred reply; later ones are follow-up messages.
+class InteractionContext:
+    def __init__(self, bot, interaction: dict, command: str):
+        self.bot = bot
+        self.http = bot.http
+        self.interaction_id = interaction["id"]
+        self.token = interaction["token"]
+        self.application_id = interaction["application_id"]
+        self.command = SimpleNamespace(name=command)
+
+        user = interaction["member"]["user"] if "member" in interaction else interaction["user"]
+        channel_id = int(interaction["channel_id"])
+        guild_id = interaction.get("guild_id")
+
+        self.author = SimpleNamespace(id=int(user["id"]), name=user["username"])
+        self.channel = bot.get_channel(channel_id) or SimpleNamespace(id=channel_id)
+        self.guild = None if guild_id is None else (bot.get_guild(int(guild_id)) or SimpleNamespace(id=int(guild_id)))
+
+        # There's no invoking message to clean up
+        self.message = SimpleNamespace(delete=self._nothing)
+
+        self._lock = asyncio.Lock()
+        self._responded = False
+        self._deferred = False  # Answered with "thinking...", and the reply still has to be filled in
+        self._watchdog: asyncio.Task = None
+
+    async def _nothing(self):
+        pass
+
+    def watch(self):
+        # Defers automatically if the command hasn't answered in time
+        self._watchdog = asyncio.ensure_future(self._defer_later())
+
+    async def _defer_later(self):
+        await asyncio.sleep(INTERACTION_DEFER_AFTER)
+        await self.defer()
+
+    async def defer(self):
+        async with self._lock:
+            if self._responded:
+                return
+
+            await self._callback(DEFERRED_CHANNEL_MESSAGE)
+            self._responded = True
+            self._deferred = True
+
+    async def finish(self):
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+
+        # A command that never sent anything would leave "thinking..." up forever
+        async with self._lock:
+            if self._deferred:
+                self._deferred = False
+                await InteractionMessage(self, ORIGINAL, self.channel.id).delete()
+
+    async def send(self, content: str = None, embed: discord.Embed = None, embeds: list[discord.Embed] = None) -> InteractionMessage:
+        payload = message_payload(content, embed, embeds)
+
+        async with self._lock:
+            if not self._responded:
+                await self._callback(CHANNEL_MESSAGE, payload)
+                self._responded = True
+                return InteractionMessage(self, ORIGINAL, self.channel.id)
+
+            if self._deferred:
+                self._deferred = False
+                return await self.edit(ORIGINAL, payload)
+
+        message = await self.http.request(
+            InteractionRoute("POST", "/webhooks/{application_id}/{token}", application_id=self.application_id, token=self.token),
+            json=payload
+        )
+        return InteractionMessage(self, message["id"], self.channel.id)
+
+    async def edit(self, message_id: str, payload: dict) -> InteractionMessage:
+        message = await self.http.request(self.message_route("PATCH", message_id), json=payload)
+        return InteractionMessage(self, message["id"], self.channel.id)
+
+    async def original_id(self) -> str:
+        message = await self.http.request(self.message_route("GET", ORIGINAL))
+        return message["id"]
+
+    def message_route(self, method: str, message_id: str) -> InteractionRoute:
+        # Route parameters are quoted, which would turn @original into an id Discord doesn't know
+        if message_id == ORIGINAL:
+            return InteractionRoute(method, "/webhooks/{application_id}/{token}/messages/@original", application_id=self.application_id, token=self.token)
+
+        return InteractionRoute(method, "/webhooks/{application_id}/{token}/messages/{message_id}", application_id=self.application_id,
+                                token=self.token, message_id=message_id)
+
+    async def _callback(self, response_type: int, data: dict = None):
+        payload = {"type": response_type}
+
+        if data is not None:
+            payload["data"] = data
+
+        await self.http.request(
+            InteractionRoute("POST", "/interactions/{interaction_id}/{token}/callback", interaction_id=self.interaction_id, token=self.token),
+            json=payload
+        )
+
+
+async def autocomplete(http, interaction: dict, choices: list[str]):
+    await http.request(
+        InteractionRoute("POST", "/interactions/{interaction_id}/{token}/callback", interaction_id=interaction["id"], token=interaction["token"]),
+        json={"type": AUTOCOMPLETE_RESULT, "data": {"choices": [{"name": choice, "value": choice} for choice in choices]}}
+    )
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import numpy as np
+
+from simulator import AttackModel
+
+MASS_ROLL_MAX = 100
+
+rng = np.random.default_rng()
+
+
+def roll_d20(count: int, advantage: int = 0) -> np.ndarray:
+    if advantage == 0:
+        return rng.integers(1, 21, size=count)
+
+    pairs = rng.integers(1, 21, size=(count, 2))
+    return pairs.max(axis=1) if advantage > 0 else pairs.min(axis=1)
+
+
+def roll_attacks(models: list[AttackModel], count: int) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    # One batch per attack covers every creature; each entry holds hits, crits and damage per creature
+    return [model.sample(rng, count) for model in models]
+
+
+def list_creatures(mask: np.ndarray) -> str:
+    return ", ".join([f"#{index + 1}" for index in np.flatnonzero(mask)])
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import itertools
+
+from datetime import datetime
+
+from character_store import CharacterStore, CharacterWrite, ConflictError, join, project, split
+
+
+# Keeps everything in process memory; for tests, benchmarks and throwaway bots
+class MemoryStore(CharacterStore):
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._links: dict[int, dict] = {}
+        self._sheets: dict[str, dict] = {}
+        self._initiatives: dict[str, dict] = {}
+
+    def _join(self, link: dict, fields: list[str] = None) -> dict:
+        return project(join(link, self._sheets.get(link["sheet"], {})), fields)
+
+    async def find_all(self, channel: int, fields: list[str] = None) -> list[dict]:
+        links = [link for link in self._links.values() if link["channel"] == str(channel)]
+        links.sort(key=lambda link: link["name_lower"])
+        return [self._join(link, fields) for link in links]
+
+    async def find(self, channel: int, name: str, exact: bool = False, fields: list[str] = None) -> dict:
+        prefix = name.lower()
+
+        for document in await self.find_all(channel, fields):
+            if exact and document["name"] == name:
+                return document
+            if not exact and document["name_lower"].startswith(prefix):
+                return document
+
+        return None
+
+    async def find_sheet(self, sheet: str) -> dict:
+        sheet_document = self._sheets.get(sheet)
+        return None if sheet_document is None else dict(sheet_document)
+
+    async def find_stale(self, cutoff: datetime) -> dict:
+        stale = [sheet_document for sheet_document in self._sheets.values() if sheet_document.get("last_synced") is None or sheet_document["last_synced"] < cutoff]
+
+        # Never-synced sheets sort first
+        stale.sort(key=lambda sheet_document: (sheet_document.get("last_synced") is not None, sheet_document.get("last_synced") or datetime.min))
+
+        for sheet_document in stale:
+            for link in self._links.values():
+                if link["sheet"] == sheet_document["_id"]:
+                    return self._join(link)
+
+        return None
+
+    async def write_all(self, writes: list[CharacterWrite]) -> list:
+        document_ids = []
+
+        # All or nothing, like the SQLite transaction
+        for write in writes:
+            if write.document_id is not None and write.document_id not in self._links:
+                raise ConflictError(write.sheet)
+
+            # Like MongoStore, only a new character may create its sheet document
+            if write.document_id is None and write.version is None:
+                continue
+
+            if write.sheet not in self._sheets:
+                raise ConflictError(write.sheet)
+
+            if write.version is not None and self._sheets[write.sheet].get("version") != write.version:
+                raise ConflictError(write.sheet)
+
+        for write in writes:
+            link_fields, sheet_fields = split(write.fields)
+            link = self._lookup(write)
+
+            if link is None:
+                link = {"_id": next(self._ids), "channel": write.channel, "sheet": write.sheet, "name": write.name, "name_lower": write.name.lower()}
+                self._links[link["_id"]] = link
+
+            link.update(link_fields)
+            self._sheets.setdefault(write.sheet, {"_id": write.sheet}).update(sheet_fields)
+
+            if "name" in write.fields:
+                for other in self._links.values():
+                    if other["sheet"] == write.sheet:
+                        other.update({key: link[key] for key in ("name", "name_lower")})
+
+            document_ids.append(link["_id"])
+
+        return document_ids
+
+    def _lookup(self, write: CharacterWrite) -> dict:
+        if write.document_id is not None:
+            return self._links.get(write.document_id)
+
+        for link in self._links.values():
+            if link["channel"] == write.channel and link["name"] == write.name:
+                return link
+
+        return None
+
+    async def delete(self, document_id):
+        link = self._links.pop(document_id, None)
+
+        if link is not None and not any(other["sheet"] == link["sheet"] for other in self._links.values()):
+            self._sheets.pop(link["sheet"], None)
+
+    async def watch(self, interval: float):
+        # No other process can write here, so there is never anything to report
+        for change in ():
+            yield change
+
+    async def find_tracker(self, channel: int) -> dict:
+        document = self._initiatives.get(str(channel))
+        return None if document is None else dict(document)
+
+    async def save_tracker(self, document: dict):
+        self._initiatives[document["channel"]] = dict(document)
+
+    async def delete_tracker(self, channel: int):
+        self._initiatives.pop(str(channel), None)
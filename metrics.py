@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Upper bounds in seconds, from a fast cache hit to a slow Sheets fetch
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# Driver callbacks run on Motor's worker threads, so every metric takes a lock
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge(Counter):
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one counts values above every bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self) -> tuple[list[int], int, float]:
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+    def quantile(self, q: float) -> float:
+        # Interpolated within the bucket, the same estimate Prometheus' histogram_quantile makes
+        counts, count, _ = self.snapshot()
+
+        if count == 0:
+            return 0.0
+
+        rank = q * count
+        cumulative = 0
+
+        for i, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / bucket_count
+
+            cumulative += bucket_count
+
+        return self.buckets[-1]
+
+
+# Name -> {sorted label pairs -> metric}
+_metrics: dict[str, dict[tuple, object]] = {}
+_metrics_lock = threading.Lock()
+
+
+def _get(kind: type, name: str, labels: dict):
+    key = tuple(sorted(labels.items()))
+
+    with _metrics_lock:
+        family = _metrics.setdefault(name, {})
+        metric = family.get(key)
+
+        if metric is None:
+            metric = kind()
+            family[key] = metric
+
+    if not isinstance(metric, kind):
+        raise ValueError(f"Metric \"{name}\" is already a {type(metric).__name__}.")
+
+    return metric
+
+
+def counter(name: str, **labels) -> Counter:
+    return _get(Counter, name, labels)
+
+
+def gauge(name: str, **labels) -> Gauge:
+    return _get(Gauge, name, labels)
+
+
+def histogram(name: str, **labels) -> Histogram:
+    return _get(Histogram, name, labels)
+
+
+def collect() -> dict[str, dict[tuple, object]]:
+    with _metrics_lock:
+        return {name: dict(family) for name, family in _metrics.items()}
+
+
+def summarize(name: str) -> list[tuple[str, int, float, float, float, float]]:
+    # (labels, count, mean, p50, p95, p99) for every histogram in a family, slowest p99 first
+    rows = []
+
+    for key, metric in collect().get(name, {}).items():
+        _, count, total = metric.snapshot()
+
+        if count == 0:
+            continue
+
+        labels = " ".join(str(value) for _, value in key)
+        rows.append((labels, count, total / count, metric.quantile(0.5), metric.quantile(0.95), metric.quantile(0.99)))
+
+    rows.sort(key=lambda row: row[5], reverse=True)
+    return rows
+
+
+# Timing
+
+@contextmanager
+def timer(name: str, **labels):
+    started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        histogram(name, **labels).observe(time.perf_counter() - started)
+
+
+def span(phase: str):
+    return timer("npchelper_phase_seconds", phase=phase)
+
+
+def traced(phase: str):
+    # Times every call of a function, sync or async, as one phase
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with span(phase):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with span(phase):
+                    return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# Prometheus text format
+
+def format_labels(key: tuple, extra: str = None) -> str:
+    pairs = [f"{name}=\"{value}\"" for name, value in key]
+
+    if extra is not None:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+
+def render() -> str:
+    lines = []
+
+    for name, family in sorted(collect().items()):
+        kind = type(next(iter(family.values())))
+        lines.append(f"# TYPE {name} {kind.__name__.lower()}")
+
+        for key, metric in sorted(family.items()):
+            if isinstance(metric, Histogram):
+                counts, count, total = metric.snapshot()
+                cumulative = 0
+
+                for bound, bucket_count in zip(list(metric.buckets) + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    bucket_labels = format_labels(key, "le=\"" + str(bound) + "\"")
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+
+                lines.append(f"{name}_sum{format_labels(key)} {total}")
+                lines.append(f"{name}_count{format_labels(key)} {count}")
+            else:
+                lines.append(f"{name}{format_labels(key)} {metric.value}")
+
+    return "\n".join(lines) + "\n"
+
+
+async def serve(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    # Bound to localhost by default; put a scraper or a tunnel in front of it rather than exposing it
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    application = web.Application()
+    application.router.add_get("/metrics", handle)
+
+    runner = web.AppRunner(application)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
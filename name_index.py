@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import os
+
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+NAME_INDEX_CHANNELS = int(os.getenv("NAME_INDEX_CHANNELS", "4096"))
+
+# Discord shows at most this many autocomplete choices
+MAX_CHOICES = 25
+
+# Which of a character's names each action can target
+ACTION_KINDS = {"check": ["abilities", "skills"], "save": ["saves"], "attack": ["attacks"], "simulate": ["attacks"]}
+
+
+def suggest(names: list[str], typed: str, limit: int = MAX_CHOICES) -> list[str]:
+    # Names starting with what was typed first, then names containing it anywhere
+    typed = typed.lower()
+    starts = [name for name in names if name.lower().startswith(typed)]
+    contains = [name for name in names if typed in name.lower() and name not in starts]
+    return (starts + contains)[:limit]
+
+
+class IndexEntry:
+    __slots__ = ("sheet", "name", "abilities", "saves", "skills", "attacks")
+
+    def __init__(self, character):
+        self.sheet = character.sheet
+        self.name = character.name
+        self.abilities = [ability.name for ability in character.abilities]
+        self.saves = [save.name for save in character.saves]
+        self.skills = [skill.name for skill in character.skills]
+        self.attacks = list(dict.fromkeys(attack.name for attack in character.attacks))
+
+
+# Names of every character in recently used channels, with their stat and attack names, so autocomplete
+# never has to wait on the store. Entries are only built from fully loaded characters.
+class NameIndex:
+    def __init__(self, max_channels: int = NAME_INDEX_CHANNELS):
+        self._max_channels = max_channels
+
+        # Channel -> {link id -> entry}, least recently used first
+        self._channels: OrderedDict[int, dict[object, IndexEntry]] = OrderedDict()
+
+    def has(self, channel: int) -> bool:
+        return channel in self._channels
+
+    def replace(self, channel: int, characters: list):
+        self._channels[channel] = {character._id: IndexEntry(character) for character in characters}
+        self._channels.move_to_end(channel)
+
+        while len(self._channels) > self._max_channels:
+            self._channels.popitem(last=False)
+
+    def add(self, character):
+        # Channels that were never loaded whole stay out, so a listed channel is always complete
+        entry = IndexEntry(character)
+        entries = self._channels.get(character.channel)
+
+        if entries is not None and character._id is not None:
+            entries[character._id] = entry
+
+        # Other channels linked to the same sheet share its names
+        for channel, entries in self._channels.items():
+            if channel == character.channel:
+                continue
+
+            for document_id, other in entries.items():
+                if other.sheet == character.sheet:
+                    entries[document_id] = entry
+
+    def remove(self, document_id):
+        for entries in self._channels.values():
+            entries.pop(document_id, None)
+
+    def names(self, channel: int, typed: str) -> list[str]:
+        entries = self._channels.get(channel)
+
+        if entries is None:
+            return []
+
+        self._channels.move_to_end(channel)
+        return suggest(sorted(entry.name for entry in entries.values()), typed)
+
+    def find(self, channel: int, name: str) -> IndexEntry:
+        # The same character the text commands would pick: an exact name, else the first by prefix
+        entries = sorted(self._channels.get(channel, {}).values(), key=lambda entry: entry.name.lower())
+
+        for entry in entries:
+            if entry.name == name:
+                return entry
+
+        for entry in entries:
+            if entry.name.lower().startswith(name.lower()):
+                return entry
+
+        return None
+
+    def targets(self, channel: int, name: str, action: str, typed: str) -> list[str]:
+        entry = self.find(channel, name)
+        kinds = next((kinds for prefix, kinds in ACTION_KINDS.items() if prefix.startswith(action.lower())), None)
+
+        if entry is None or kinds is None:
+            return []
+
+        targets = []
+
+        for kind in kinds:
+            targets.extend(getattr(entry, kind))
+
+        return suggest(targets, typed)
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import weakref
+
+import discord
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "5"))
+
+# With reactions off, crits are marked in the embed title and cost no extra calls
+CRIT_REACTIONS = os.getenv("CRIT_REACTIONS", "1") == "1"
+
+# Messages carry several embeds from discord.py 2.0 on
+MULTI_EMBED = discord.version_info.major >= 2
+MAX_EMBEDS = 10
+
+CRITICAL_HIT = "\U00002764"
+CRITICAL_MISS = "\U0001F622"
+
+
+class RollMessage:
+    def __init__(self, embed: discord.Embed = None, critical_hit: bool = False, critical_miss: bool = False, error: str = None):
+        self.embed = embed
+        self.critical_hit = critical_hit
+        self.critical_miss = critical_miss
+        self.error = error
+
+    def reactions(self) -> list[str]:
+        reactions = []
+
+        if self.critical_hit:
+            reactions.append(CRITICAL_HIT)
+
+        if self.critical_miss:
+            reactions.append(CRITICAL_MISS)
+
+        return reactions
+
+    def marked_embed(self) -> discord.Embed:
+        if CRIT_REACTIONS or not (self.critical_hit or self.critical_miss):
+            return self.embed
+
+        self.embed.title = f"{self.embed.title} {' '.join(self.reactions())}"
+        return self.embed
+
+
+class Outbox:
+    def __init__(self, concurrency: int = OUTBOX_CONCURRENCY):
+        self._concurrency = concurrency
+
+        # One semaphore per channel, matching Discord's per-channel message bucket; dropped when idle
+        self._channels = weakref.WeakValueDictionary()
+
+    def _semaphore(self, channel_id: int) -> asyncio.Semaphore:
+        semaphore = self._channels.get(channel_id)
+
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._concurrency)
+            self._channels[channel_id] = semaphore
+
+        return semaphore
+
+    @metrics.traced("discord.send")
+    async def post(self, context, roll_messages: list[RollMessage], delete_invocation: bool = False) -> bool:
+        errors = [roll_message.error for roll_message in roll_messages if roll_message.error is not None]
+        rolls = [roll_message for roll_message in roll_messages if roll_message.error is None]
+        semaphore = self._semaphore(context.channel.id)
+
+        # None of these depend on each other, so they all go out at once
+        calls = []
+
+        if MULTI_EMBED:
+            # Up to ten results per message, so a typical party lands in a single send
+            for i in range(0, len(rolls), MAX_EMBEDS):
+                calls.append(self._send(semaphore, context, rolls[i:i + MAX_EMBEDS]))
+        else:
+            for roll_message in rolls:
+                calls.append(self._send(semaphore, context, [roll_message]))
+
+        if len(errors) > 0:
+            calls.append(self._send_text(semaphore, context, "\n".join(errors)))
+
+        if delete_invocation and len(rolls) > 0:
+            calls.append(context.message.delete())
+
+        await asyncio.gather(*calls)
+
+        return len(rolls) > 0
+
+    async def _send(self, semaphore: asyncio.Semaphore, context, roll_messages: list[RollMessage]):
+        embeds = [roll_message.marked_embed() for roll_message in roll_messages]
+
+        async with semaphore:
+            if len(embeds) == 1:
+                sent_message: discord.Message = await context.send(embed=embeds[0])
+            else:
+                sent_message: discord.Message = await context.send(embeds=embeds)
+
+        if not CRIT_REACTIONS:
+            return
+
+        reactions = []
+
+        for roll_message in roll_messages:
+            reactions.extend([reaction for reaction in roll_message.reactions() if reaction not in reactions])
+
+        await asyncio.gather(*[sent_message.add_reaction(reaction) for reaction in reactions])
+
+    async def _send_text(self, semaphore: asyncio.Semaphore, context, content: str):
+        async with semaphore:
+            await context.send(content)
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+SCHEDULER_INTERACTIVE_CONCURRENCY = int(os.getenv("SCHEDULER_INTERACTIVE_CONCURRENCY", "32"))
+SCHEDULER_UPDATE_CONCURRENCY = int(os.getenv("SCHEDULER_UPDATE_CONCURRENCY", "8"))
+SCHEDULER_BULK_CONCURRENCY = int(os.getenv("SCHEDULER_BULK_CONCURRENCY", "2"))
+
+# Rolls and other quick replies; commands a user started that read sheets or write characters;
+# and work nobody is waiting on right now, like a channel-wide refresh or the background sheet sync
+INTERACTIVE = "interactive"
+UPDATE = "update"
+BULK = "bulk"
+
+
+def queue(name: str):
+    # Put under @commands.command to run the command in another queue than INTERACTIVE
+    def decorator(function):
+        function.__scheduler_queue__ = name
+        return function
+
+    return decorator
+
+
+def guild_of(context) -> int:
+    # Fairness is per guild; DMs count as a guild of their own
+    return context.guild.id if context.guild is not None else context.channel.id
+
+
+class Queue:
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.running = 0
+
+        # Guild -> its waiters in arrival order; guilds take turns, the one served last goes to the back
+        self.waiting: OrderedDict[object, deque] = OrderedDict()
+        self.depth = 0
+
+
+# Each queue has its own slots, so bulk work can never hold up a roll, and within a queue one
+# guild's backlog can't starve another's: a freed slot goes to the next guild in turn.
+class Scheduler:
+    def __init__(self, limits: dict = None):
+        if limits is None:
+            limits = {INTERACTIVE: SCHEDULER_INTERACTIVE_CONCURRENCY, UPDATE: SCHEDULER_UPDATE_CONCURRENCY, BULK: SCHEDULER_BULK_CONCURRENCY}
+
+        self._queues = {name: Queue(name, concurrency) for name, concurrency in limits.items()}
+
+    @asynccontextmanager
+    async def slot(self, name: str, guild):
+        queue = self._queues[name]
+        started = time.perf_counter()
+
+        if queue.running < queue.concurrency and queue.depth == 0:
+            queue.running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            queue.waiting.setdefault(guild, deque()).append(future)
+            self._set_depth(queue, queue.depth + 1)
+
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    self._forget(queue, guild, future)
+                else:
+                    # The slot was handed over just as the caller went away; pass it on
+                    self._release(queue)
+
+                raise
+
+        metrics.histogram("npchelper_queue_wait_seconds", queue=name).observe(time.perf_counter() - started)
+        metrics.gauge("npchelper_queue_running", queue=name).set(queue.running)
+
+        try:
+            yield
+        finally:
+            self._release(queue)
+
+    async def run(self, name: str, guild, function, *args):
+        async with self.slot(name, guild):
+            return await function(*args)
+
+    def _release(self, queue: Queue):
+        # The slot goes straight to the next waiter, so nobody can jump the queue in between
+        while len(queue.waiting) > 0:
+            guild, waiters = next(iter(queue.waiting.items()))
+            future = waiters.popleft()
+
+            if len(waiters) > 0:
+                queue.waiting.move_to_end(guild)
+            else:
+                del queue.waiting[guild]
+
+            self._set_depth(queue, queue.depth - 1)
+
+            if not future.done():
+                future.set_result(None)
+                return
+
+        queue.running -= 1
+        metrics.gauge("npchelper_queue_running", queue=queue.name).set(queue.running)
+
+    def _forget(self, queue: Queue, guild, future: asyncio.Future):
+        waiters = queue.waiting.get(guild)
+
+        if waiters is None or future not in waiters:
+            return
+
+        waiters.remove(future)
+        self._set_depth(queue, queue.depth - 1)
+
+        if len(waiters) == 0:
+            del queue.waiting[guild]
+
+    def _set_depth(self, queue: Queue, depth: int):
+        queue.depth = depth
+        metrics.gauge("npchelper_queue_depth", queue=queue.name).set(depth)
+
+    def depths(self) -> dict[str, tuple[int, int]]:
+        # Queue -> (waiting, running)
+        return {name: (queue.depth, queue.running) for name, queue in self._queues.items()}
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import csv
+import gzip
+import io
+import json
+import zlib
+
+from character import NAMED_RANGES, Character
+from character_store import CharacterStore, local_sheet_id
+
+EXPORT_FORMAT = "npchelper-characters"
+EXPORT_VERSION = 1
+
+# Fields that belong to a channel or a database rather than to the character
+EXPORT_EXCLUDED = ["_id", "channel", "version", "updated", "last_synced"]
+
+# A character can't be read without these; any other range may be left out when it's empty
+REQUIRED_RANGES = ["system", "name", "initiative"]
+
+
+def is_export(data: bytes, filename: str) -> bool:
+    if not filename.lower().endswith((".json", ".json.gz")):
+        return False
+
+    return read_json(data, filename).get("format") == EXPORT_FORMAT
+
+
+def read_json(data: bytes, filename: str) -> dict:
+    if filename.lower().endswith(".gz"):
+        try:
+            data = gzip.decompress(data)
+        except (OSError, EOFError, zlib.error) as error:
+            raise ValueError("The file is not valid gzip.") from error
+
+    return json.loads(data.decode("utf-8"))
+
+
+def load_snapshot(data: bytes, filename: str) -> dict:
+    # Returns the same named ranges GoogleSheet.batch_get does
+    name = filename.lower()
+
+    if name.endswith((".json", ".json.gz")):
+        return load_json(read_json(data, filename))
+
+    if name.endswith(".csv"):
+        return load_csv(data.decode("utf-8-sig"))
+
+    if name.endswith(".xlsx"):
+        return load_xlsx(data)
+
+    raise ValueError(f"Unsupported snapshot file \"{filename}\".")
+
+
+def load_json(document: dict) -> dict:
+    # Either {"ranges": {name: rows}} or a recorded values:batchGet response
+    if "ranges" in document:
+        ranges = document["ranges"]
+    elif "valueRanges" in document:
+        ranges = {name: value_range.get("values", []) for name, value_range in zip(NAMED_RANGES, document["valueRanges"])}
+    else:
+        raise ValueError("Snapshot has neither \"ranges\" nor \"valueRanges\".")
+
+    return complete(ranges)
+
+
+def load_csv(text: str) -> dict:
+    # One sheet row per line, prefixed with the name of the range it belongs to
+    ranges = {}
+
+    for row in csv.reader(io.StringIO(text)):
+        if len(row) == 0 or row[0] == "":
+            continue
+
+        ranges.setdefault(row[0], []).append(trim(row[1:]))
+
+    return complete(ranges)
+
+
+def load_xlsx(data: bytes) -> dict:
+    # A Google Sheets download keeps its named ranges as defined names
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(io.BytesIO(data), data_only=True, read_only=False)
+    ranges = {}
+
+    for name in NAMED_RANGES:
+        if name not in workbook.defined_names:
+            continue
+
+        rows = []
+
+        for title, reference in workbook.defined_names[name].destinations:
+            cells = workbook[title][reference.replace("$", "")]
+
+            if not isinstance(cells, tuple):
+                cells = ((cells,),)
+            elif not isinstance(cells[0], tuple):
+                cells = (cells,)
+
+            for cell_row in cells:
+                rows.append(trim([cell_text(cell.value) for cell in cell_row]))
+
+        # The Sheets API leaves out trailing empty rows as well
+        while len(rows) > 0 and len(rows[-1]) == 0:
+            rows.pop()
+
+        ranges[name] = rows
+
+    return complete(ranges)
+
+
+def cell_text(value) -> str:
+    if value is None:
+        return ""
+
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+
+    return str(value)
+
+
+def trim(cells: list[str]) -> list[str]:
+    # The Sheets API leaves out trailing empty cells; snapshots should parse the same way
+    while len(cells) > 0 and cells[-1] == "":
+        cells = cells[:-1]
+
+    return cells
+
+
+def complete(ranges: dict) -> dict:
+    missing = [name for name in REQUIRED_RANGES if len(ranges.get(name, [])) == 0]
+
+    if len(missing) > 0:
+        raise ValueError("Snapshot is missing ranges: " + ", ".join(missing))
+
+    # Like an empty range in a values:batchGet response, which has no rows at all
+    return {name: ranges.get(name, []) for name in NAMED_RANGES}
+
+
+def export_characters(characters: list[Character]) -> bytes:
+    documents = []
+
+    for character in characters:
+        document = character.to_dict()
+
+        for field in EXPORT_EXCLUDED:
+            document.pop(field, None)
+
+        documents.append(document)
+
+    export = {
+        "format": EXPORT_FORMAT,
+        "version": EXPORT_VERSION,
+        "characters": documents
+    }
+
+    return gzip.compress(json.dumps(export, separators=(",", ":")).encode("utf-8"))
+
+
+def import_characters(data: bytes, filename: str, store: CharacterStore, channel: int, cache=None) -> list[Character]:
+    characters = []
+
+    for document in read_json(data, filename)["characters"]:
+        document["channel"] = str(channel)
+
+        # An import is a copy as of the export. Under the real sheet id it would overwrite the data every channel
+        # linked to that sheet shares, so it becomes a snapshot of its own, like an imported sheet.
+        document["sheet"] = local_sheet_id()
+        document.pop("revision", None)
+        document.pop("content_hash", None)
+
+        character = Character.from_dict(document)
+        character._store = store
+        character._cache = cache
+
+        # Imported characters are new to this channel and get written in full
+        character._dirty = None
+        characters.append(character)
+
+    return characters
+
+
+def snapshot_character(data: bytes, filename: str, store: CharacterStore, channel: int, cache=None) -> Character:
+    character = Character()
+
+    character._store = store
+    character._cache = cache
+    character.channel = channel
+    character.sheet = local_sheet_id()
+    character.load(load_snapshot(data, filename))
+
+    return character
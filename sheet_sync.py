@@ -0,0 +1,112 @@
+import asyncio
+import os
+import random
+import traceback
+
+from datetime import datetime, timedelta
+
+import gspread
+
+from dotenv import load_dotenv
+
+from character import Character
+from character_store import CharacterStore, ConflictError
+from rate_limit import TokenBucket
+from scheduler import BULK, Scheduler
+
+load_dotenv()
+SHEET_SYNC_MAX_AGE = float(os.getenv("SHEET_SYNC_MAX_AGE", "3600"))
+SHEET_SYNC_REQUESTS_PER_MINUTE = float(os.getenv("SHEET_SYNC_REQUESTS_PER_MINUTE", "10"))
+SHEET_SYNC_JITTER = float(os.getenv("SHEET_SYNC_JITTER", "5"))
+SHEET_SYNC_IDLE = 60.0
+SHEET_SYNC_BACKOFF_MIN = 5.0
+SHEET_SYNC_BACKOFF_MAX = 900.0
+
+
+class SheetSyncWorker:
+    def __init__(self, store: CharacterStore, max_age: float = SHEET_SYNC_MAX_AGE, requests_per_minute: float = SHEET_SYNC_REQUESTS_PER_MINUTE, cache=None, scheduler: Scheduler = None):
+        self._store = store
+        self._cache = cache
+        self._scheduler = scheduler
+        self._max_age = max_age
+
+        # Background budget on top of the global Sheets limit, so interactive updates keep most of the quota
+        self._bucket = TokenBucket(requests_per_minute / 60, 1)
+        self._backoff = 0.0
+        self._task: asyncio.Task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run(self):
+        # Nothing but cancellation ends the worker; a failed step backs it off and it tries again
+        while True:
+            try:
+                await self._step()
+            except self._store.unavailable_errors as error:
+                self._back_off("Sheet sync can't reach the store", error)
+            except Exception as error:
+                self._back_off("Sheet sync failed", error)
+                traceback.print_exc()
+
+            if self._backoff > 0:
+                await asyncio.sleep(self._backoff * random.uniform(0.5, 1.5))
+
+    async def _step(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self._max_age)
+        character = await Character.get_stale(self._store, cutoff)
+
+        if character is None:
+            self._backoff = 0.0
+            await asyncio.sleep(SHEET_SYNC_IDLE + random.uniform(0, SHEET_SYNC_JITTER))
+            return
+
+        # Committing through the cache keeps its copy at the version just written
+        character._cache = self._cache
+
+        await asyncio.sleep(random.uniform(0, SHEET_SYNC_JITTER))
+        await self._bucket.acquire()
+
+        # Behind bulk work from commands, taking turns with the guilds that have some queued
+        if self._scheduler is not None:
+            await self._scheduler.run(BULK, None, self.sync, character)
+        else:
+            await self.sync(character)
+
+    def _back_off(self, message: str, error: BaseException):
+        # Quota, network and store trouble affects every sheet, so slow the whole worker down
+        self._backoff = min(max(self._backoff * 2, SHEET_SYNC_BACKOFF_MIN), SHEET_SYNC_BACKOFF_MAX)
+        print(f"{message}, backing off {self._backoff:.0f}s: {error!r}")
+
+    async def sync(self, character: Character):
+        try:
+            await character.refresh()
+            self._backoff = 0.0
+            return
+        except ConflictError:
+            # Written by someone else in the meantime, so it isn't stale any more
+            return
+        except self._store.unavailable_errors:
+            # Nothing can be marked either; the run loop backs off
+            raise
+        except (gspread.exceptions.GSpreadException, asyncio.TimeoutError, OSError) as error:
+            self._back_off(f"Sheet sync failed for {character.name}", error)
+        except (ValueError, IndexError, KeyError) as error:
+            print(f"Sheet sync can't parse {character.name}: {error!r}")
+        except Exception as error:
+            print(f"Sheet sync failed for {character.name}: {error!r}")
+            traceback.print_exc()
+
+        # Failed sheets go to the back of the queue as well, so one broken sheet can't stall the rest
+        character.mark_synced()
+
+        try:
+            await character.commit()
+        except ConflictError:
+            pass
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import re
+
+import numpy as np
+
+from stats import Attack, Keyword
+
+TERM_PATTERN = re.compile(r"([+-])\s*(?:(\d*)\s*d\s*(\d+)|(\d+))")
+
+# Largest damage range the exact mode will build distributions for
+EXACT_SUPPORT_LIMIT = 100000
+
+
+# Sums of plain dice and constants, the subset of d20 syntax that can be sampled in bulk
+class DamageExpression:
+    def __init__(self, dice: list[tuple[int, int, int]], constant: int):
+        self.dice = dice  # (sign, count, sides)
+        self.constant = constant
+
+    @classmethod
+    def parse(cls, expression: str) -> DamageExpression:
+        text = expression.strip()
+
+        if not text.startswith(("+", "-")):
+            text = "+" + text
+
+        dice = []
+        constant = 0
+        position = 0
+
+        while position < len(text):
+            match = TERM_PATTERN.match(text, position)
+
+            if match is None:
+                raise ValueError(f"Can't simulate dice expression \"{expression}\".")
+
+            sign = -1 if match.group(1) == "-" else 1
+
+            if match.group(3) is not None:
+                count = int(match.group(2)) if match.group(2) else 1
+                dice.append((sign, count, int(match.group(3))))
+            else:
+                constant += sign * int(match.group(4))
+
+            position = match.end()
+
+            while position < len(text) and text[position].isspace():
+                position += 1
+
+        return cls(dice, constant)
+
+    def sample(self, rng: np.random.Generator, trials: int) -> np.ndarray:
+        totals = np.full(trials, self.constant, dtype=np.int64)
+
+        for sign, count, sides in self.dice:
+            totals += sign * rng.integers(1, sides + 1, size=(trials, count)).sum(axis=1)
+
+        return totals
+
+    def distribution(self) -> tuple[int, np.ndarray]:
+        # Probability of each total, starting at the returned offset
+        offset = self.constant
+        probabilities = np.ones(1)
+
+        for sign, count, sides in self.dice:
+            die = np.full(sides, 1 / sides)
+
+            for _ in range(count):
+                probabilities = np.convolve(probabilities, die if sign > 0 else die[::-1])
+
+                if len(probabilities) > EXACT_SUPPORT_LIMIT:
+                    raise ValueError("Dice expression is too large for exact mode.")
+
+            offset += count if sign > 0 else -count * sides
+
+        return offset, probabilities
+
+
+# Odds for each natural d20 result, following the same 5e and 3.5e rules as the attack commands
+class AttackModel:
+    def __init__(self, attack: Attack, system: str, armor_class: int, advantage: int = 0, switches: dict = {}):
+        naturals = np.arange(1, 21)
+        keywords = attack.keywords
+        bonus_attack = 0
+        bonus_damage = 0
+
+        if system == "dnd5":
+            if advantage > 0:
+                self.natural_odds = (2 * naturals - 1) / 400
+            elif advantage < 0:
+                self.natural_odds = (41 - 2 * naturals) / 400
+            else:
+                self.natural_odds = np.full(20, 1 / 20)
+        else:
+            # 3.5e attacks ignore advantage
+            self.natural_odds = np.full(20, 1 / 20)
+
+            if "pow" in switches:
+                power_attack_points = max(int(switches["pow"]), 0)
+                bonus_attack -= power_attack_points
+                bonus_damage += (power_attack_points * 2) if keywords & Keyword.TWO_HANDED else power_attack_points
+
+        totals = naturals + attack.hit + bonus_attack
+        self.hits = (naturals == 20) | ((naturals != 1) & (totals >= armor_class))
+        self.threats = naturals >= attack.critrange
+
+        self.system = system
+        self.critmultiplier = attack.critmultiplier
+        self.damage = DamageExpression.parse(attack.damage)
+        self.damage.constant += bonus_damage
+
+        if system == "dnd5":
+            # A natural 20 or a threat is always a hit and always a critical hit
+            self.crit_damage = DamageExpression.parse(attack.crit_damage)
+            self.threats |= naturals == 20
+            self.hits |= self.threats
+            self.confirm_chance = 1.0
+        else:
+            # A threat that hits is rolled again against the same AC to confirm
+            self.threats &= self.hits
+            self.confirm_chance = float(self.natural_odds[self.hits].sum())
+
+    def chances(self) -> tuple[float, float]:
+        hit_chance = float(self.natural_odds[self.hits].sum())
+        crit_chance = float(self.natural_odds[self.threats].sum()) * self.confirm_chance
+        return hit_chance, crit_chance
+
+    def sample(self, rng: np.random.Generator, trials: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        naturals = rng.choice(20, size=trials, p=self.natural_odds)
+        hits = self.hits[naturals]
+        crits = self.threats[naturals]
+
+        if self.system != "dnd5":
+            crits &= rng.random(trials) < self.confirm_chance
+
+        damage = self.damage.sample(rng, trials)
+
+        if self.system == "dnd5":
+            damage = np.where(crits, self.crit_damage.sample(rng, trials), damage)
+        else:
+            damage = np.where(crits, damage * self.critmultiplier, damage)
+
+        return hits, crits, np.where(hits, damage, 0)
+
+    def distribution(self) -> tuple[int, np.ndarray]:
+        hit_chance, crit_chance = self.chances()
+
+        offset, normal = self.damage.distribution()
+
+        if self.system == "dnd5":
+            crit_offset, crit = self.crit_damage.distribution()
+        else:
+            # Critical damage multiplies the whole roll, so spread the normal distribution out
+            crit_offset = offset * self.critmultiplier
+            crit = np.zeros((len(normal) - 1) * self.critmultiplier + 1)
+            crit[::self.critmultiplier] = normal
+
+        return mix([(0, np.ones(1), 1 - hit_chance), (offset, normal, hit_chance - crit_chance), (crit_offset, crit, crit_chance)])
+
+
+class SimulationResult:
+    def __init__(self, chances: list[tuple[float, float]], mean: float, percentiles: list[float]):
+        self.chances = chances  # (hit, crit) per attack
+        self.mean = mean
+        self.percentiles = percentiles
+
+
+def mix(components: list[tuple[int, np.ndarray, float]]) -> tuple[int, np.ndarray]:
+    low = min(offset for offset, _, _ in components)
+    high = max(offset + len(probabilities) for offset, probabilities, _ in components)
+    mixed = np.zeros(high - low)
+
+    for offset, probabilities, weight in components:
+        mixed[offset - low:offset - low + len(probabilities)] += weight * probabilities
+
+    return low, mixed
+
+
+def simulate(models: list[AttackModel], trials: int, quantiles: list[float], seed: int = None) -> SimulationResult:
+    rng = np.random.default_rng(seed)
+    chances = []
+    total = np.zeros(trials, dtype=np.int64)
+
+    for model in models:
+        hits, crits, damage = model.sample(rng, trials)
+        chances.append((float(hits.mean()), float(crits.mean())))
+        total += damage
+
+    return SimulationResult(chances, float(total.mean()), [float(value) for value in np.quantile(total, quantiles)])
+
+
+def solve(models: list[AttackModel], quantiles: list[float]) -> SimulationResult:
+    offset = 0
+    probabilities = np.ones(1)
+
+    for model in models:
+        model_offset, model_probabilities = model.distribution()
+        offset += model_offset
+        probabilities = np.convolve(probabilities, model_probabilities)
+
+        if len(probabilities) > EXACT_SUPPORT_LIMIT:
+            raise ValueError("Attack is too large for exact mode.")
+
+    values = np.arange(offset, offset + len(probabilities))
+    cumulative = np.cumsum(probabilities)
+    percentiles = [float(values[min(np.searchsorted(cumulative, quantile - 1e-12), len(values) - 1)]) for quantile in quantiles]
+
+    return SimulationResult([model.chances() for model in models], float((values * probabilities).sum()), percentiles)
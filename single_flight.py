@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import asyncio
+
+from contextlib import asynccontextmanager
+
+
+# Concurrent calls with the same key share the first caller's run instead of repeating it
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict[object, asyncio.Future] = {}
+
+        # Key -> (lock, holders and waiters); dropped once nobody uses it
+        self._locks: dict[object, list] = {}
+
+    def pending(self, key) -> bool:
+        return key in self._calls
+
+    async def run(self, key, function, *args):
+        future = self._calls.get(key)
+
+        if future is None:
+            future = asyncio.ensure_future(function(*args))
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+
+        # A cancelled caller must not cancel the run the others are waiting on
+        return await asyncio.shield(future)
+
+    def _finish(self, key, future: asyncio.Future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+
+    @asynccontextmanager
+    async def lock(self, key):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+
+            if entry[1] == 0:
+                del self._locks[key]
@@ -0,0 +1,338 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+
+from datetime import datetime, timedelta
+
+import aiosqlite
+
+from character_store import PREFIX_END, CharacterStore, CharacterWrite, ConflictError, join, local_sheet_id, project, split
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+SCHEMA = [
+    # Per-channel links to the shared sheet data, like the characters and sheets collections in Mongo
+    """CREATE TABLE IF NOT EXISTS links (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel TEXT NOT NULL,
+        sheet TEXT NOT NULL,
+        name TEXT NOT NULL,
+        name_lower TEXT NOT NULL,
+        updated TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS sheets (
+        sheet TEXT PRIMARY KEY,
+        last_synced TEXT,
+        updated TEXT,
+        document TEXT NOT NULL
+    )""",
+    # The same lookups the Mongo backend indexes
+    "CREATE INDEX IF NOT EXISTS links_channel_name ON links (channel, name_lower)",
+    "CREATE INDEX IF NOT EXISTS links_sheet ON links (sheet)",
+    "CREATE INDEX IF NOT EXISTS links_updated ON links (updated)",
+    "CREATE INDEX IF NOT EXISTS sheets_last_synced ON sheets (last_synced)",
+    "CREATE INDEX IF NOT EXISTS sheets_updated ON sheets (updated)",
+    "CREATE TABLE IF NOT EXISTS initiative (channel TEXT PRIMARY KEY, document TEXT NOT NULL)"
+]
+
+SELECT_CHARACTERS = "SELECT links.id, links.channel, links.sheet, links.name, links.name_lower, sheets.document FROM links LEFT JOIN sheets ON sheets.sheet = links.sheet"
+
+
+def format_time(value: datetime) -> str:
+    # Fixed width, so timestamps compare correctly as text
+    return None if value is None else value.strftime(TIME_FORMAT)
+
+
+def encode(document: dict) -> str:
+    def default(value):
+        if isinstance(value, datetime):
+            return {"$date": format_time(value)}
+        raise TypeError(f"Can't store {type(value).__name__} values.")
+
+    return json.dumps(document, default=default, separators=(",", ":"))
+
+
+def decode(text: str) -> dict:
+    def object_hook(dct):
+        if len(dct) == 1 and "$date" in dct:
+            return datetime.strptime(dct["$date"], TIME_FORMAT)
+        return dct
+
+    return json.loads(text, object_hook=object_hook)
+
+
+# A single database file, for running without a database server
+class SqliteStore(CharacterStore):
+    # Raised when another process holds the file's write lock for too long
+    unavailable_errors = (aiosqlite.OperationalError,)
+
+    def __init__(self, path: str):
+        self._path = path
+        self._connection: aiosqlite.Connection = None
+        self._lock = None
+        self._write_lock = None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._write_lock = asyncio.Lock()
+
+        async with self._lock:
+            if self._connection is None:
+                connection = await aiosqlite.connect(self._path)
+
+                for statement in SCHEMA:
+                    await connection.execute(statement)
+
+                await self._migrate(connection)
+                await connection.commit()
+                self._connection = connection
+
+        return self._connection
+
+    async def prepare(self):
+        await self._connect()
+
+    async def ping(self) -> float:
+        started = time.perf_counter()
+        connection = await self._connect()
+        await connection.execute("SELECT 1")
+        return time.perf_counter() - started
+
+    async def close(self):
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+    async def _migrate(self, connection: aiosqlite.Connection):
+        # Files from before sheet data was shared keep whole characters in one table
+        async with connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'characters'") as cursor:
+            if await cursor.fetchone() is None:
+                return
+
+        async with connection.execute("SELECT id, document FROM characters ORDER BY updated") as cursor:
+            rows = await cursor.fetchall()
+
+        # Oldest first, so the most recently updated copy of a sheet wins
+        for document_id, text in rows:
+            document = decode(text)
+
+            if not document.get("sheet"):
+                document["sheet"] = local_sheet_id()
+
+            link, sheet_document = split(document)
+            await self._insert_link(connection, document_id, link)
+            await self._upsert_sheet(connection, link["sheet"], sheet_document)
+
+            # Every link of a sheet takes the name of the copy that wins
+            await connection.execute("UPDATE links SET name = ?, name_lower = ? WHERE sheet = ?", (link["name"], link["name_lower"], link["sheet"]))
+
+        await connection.execute("DROP TABLE characters")
+
+    async def _select(self, query: str, parameters: tuple, fields: list[str] = None) -> list[dict]:
+        connection = await self._connect()
+
+        async with connection.execute(query, parameters) as cursor:
+            rows = await cursor.fetchall()
+
+        documents = []
+
+        # Sheet data is stored whole, so a projection only saves building the unused sections
+        for document_id, channel, sheet, name, name_lower, text in rows:
+            link = {"_id": document_id, "channel": channel, "sheet": sheet, "name": name, "name_lower": name_lower}
+            documents.append(project(join(link, decode(text) if text is not None else {}), fields))
+
+        return documents
+
+    async def find_all(self, channel: int, fields: list[str] = None) -> list[dict]:
+        return await self._select(
+            SELECT_CHARACTERS + " WHERE links.channel = ? ORDER BY links.name_lower",
+            (str(channel),),
+            fields
+        )
+
+    async def find(self, channel: int, name: str, exact: bool = False, fields: list[str] = None) -> dict:
+        if exact:
+            documents = await self._select(
+                SELECT_CHARACTERS + " WHERE links.channel = ? AND links.name = ? ORDER BY links.name_lower LIMIT 1",
+                (str(channel), name),
+                fields
+            )
+        else:
+            prefix = name.lower()
+            documents = await self._select(
+                SELECT_CHARACTERS + " WHERE links.channel = ? AND links.name_lower >= ? AND links.name_lower < ? ORDER BY links.name_lower LIMIT 1",
+                (str(channel), prefix, prefix + PREFIX_END),
+                fields
+            )
+
+        return documents[0] if len(documents) > 0 else None
+
+    async def find_sheet(self, sheet: str) -> dict:
+        connection = await self._connect()
+
+        async with connection.execute("SELECT document FROM sheets WHERE sheet = ?", (sheet,)) as cursor:
+            row = await cursor.fetchone()
+
+        return None if row is None else decode(row[0])
+
+    async def find_stale(self, cutoff: datetime) -> dict:
+        # NULLs sort first, the same as never-synced documents in Mongo; sheets without links never match
+        documents = await self._select(
+            SELECT_CHARACTERS + " WHERE links.id = (SELECT links.id FROM sheets JOIN links ON links.sheet = sheets.sheet"
+            " WHERE sheets.last_synced IS NULL OR sheets.last_synced < ? ORDER BY sheets.last_synced LIMIT 1)",
+            (format_time(cutoff),)
+        )
+
+        return documents[0] if len(documents) > 0 else None
+
+    async def write_all(self, writes: list[CharacterWrite]) -> list:
+        connection = await self._connect()
+
+        # One transaction for the whole batch, like a single bulk_write; the lock keeps other commits out of it
+        async with self._write_lock:
+            try:
+                return await self._write_all(connection, writes)
+            except BaseException:
+                await connection.rollback()
+                raise
+
+    async def _write_all(self, connection: aiosqlite.Connection, writes: list[CharacterWrite]) -> list:
+        document_ids = []
+
+        # Checked before anything is written, so a conflict leaves the transaction empty
+        for write in writes:
+            if write.document_id is not None:
+                async with connection.execute("SELECT 1 FROM links WHERE id = ?", (write.document_id,)) as cursor:
+                    if await cursor.fetchone() is None:
+                        raise ConflictError(write.sheet)
+
+            # Like MongoStore, only a new character may create its sheet document
+            if write.document_id is None and write.version is None:
+                continue
+
+            async with connection.execute("SELECT document FROM sheets WHERE sheet = ?", (write.sheet,)) as cursor:
+                row = await cursor.fetchone()
+
+            if row is None or (write.version is not None and decode(row[0]).get("version") != write.version):
+                raise ConflictError(write.sheet)
+
+        for write in writes:
+            link_fields, sheet_fields = split(write.fields)
+
+            if write.document_id is not None:
+                query, parameters = "SELECT id, channel, sheet, name, name_lower FROM links WHERE id = ?", (write.document_id,)
+            else:
+                query, parameters = "SELECT id, channel, sheet, name, name_lower FROM links WHERE channel = ? AND name = ?", (write.channel, write.name)
+
+            async with connection.execute(query, parameters) as cursor:
+                row = await cursor.fetchone()
+
+            if row is None:
+                document_id = write.document_id
+                link = {"channel": write.channel, "sheet": write.sheet, "name": write.name, "name_lower": write.name.lower()}
+            else:
+                document_id = row[0]
+                link = dict(zip(["channel", "sheet", "name", "name_lower"], row[1:]))
+
+            link.update(link_fields)
+            link["sheet"] = write.sheet
+
+            if row is None:
+                document_id = await self._insert_link(connection, document_id, link)
+            else:
+                await connection.execute(
+                    "UPDATE links SET channel = ?, sheet = ?, name = ?, name_lower = ?, updated = ? WHERE id = ?",
+                    (link["channel"], link["sheet"], link["name"], link["name_lower"], format_time(link.get("updated")), document_id)
+                )
+
+            await self._upsert_sheet(connection, write.sheet, sheet_fields)
+
+            # The name comes from the sheet, so every channel's link follows a rename
+            if "name" in write.fields:
+                await connection.execute("UPDATE links SET name = ?, name_lower = ? WHERE sheet = ?", (link["name"], link["name_lower"], write.sheet))
+
+            document_ids.append(document_id)
+
+        await connection.commit()
+
+        return document_ids
+
+    async def _insert_link(self, connection: aiosqlite.Connection, document_id, link: dict) -> int:
+        cursor = await connection.execute(
+            "INSERT INTO links (id, channel, sheet, name, name_lower, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            (document_id, link["channel"], link["sheet"], link["name"], link.get("name_lower", link["name"].lower()), format_time(link.get("updated")))
+        )
+
+        return cursor.lastrowid
+
+    async def _upsert_sheet(self, connection: aiosqlite.Connection, sheet: str, fields: dict):
+        async with connection.execute("SELECT document FROM sheets WHERE sheet = ?", (sheet,)) as cursor:
+            row = await cursor.fetchone()
+
+        document = decode(row[0]) if row is not None else {}
+        document.update(fields)
+
+        await connection.execute(
+            "INSERT INTO sheets (sheet, last_synced, updated, document) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (sheet) DO UPDATE SET last_synced = excluded.last_synced, updated = excluded.updated, document = excluded.document",
+            (sheet, format_time(document.get("last_synced")), format_time(document.get("updated")), encode(document))
+        )
+
+    async def delete(self, document_id):
+        connection = await self._connect()
+
+        async with self._write_lock:
+            try:
+                await connection.execute("DELETE FROM sheets WHERE sheet = (SELECT sheet FROM links WHERE id = ?)"
+                                         " AND (SELECT COUNT(*) FROM links WHERE sheet = sheets.sheet) = 1", (document_id,))
+                await connection.execute("DELETE FROM links WHERE id = ?", (document_id,))
+                await connection.commit()
+            except BaseException:
+                await connection.rollback()
+                raise
+
+    async def watch(self, interval: float):
+        # Other processes may share the file; like a standalone Mongo server, only updates can be seen
+        since = datetime.utcnow()
+
+        while True:
+            await asyncio.sleep(interval)
+
+            now = datetime.utcnow()
+            window = format_time(since - timedelta(seconds=interval))
+            documents = await self._select(
+                SELECT_CHARACTERS + " WHERE links.updated > ? OR sheets.updated > ?",
+                (window, window)
+            )
+            since = now
+
+            for document in documents:
+                yield "update", document
+
+    async def find_tracker(self, channel: int) -> dict:
+        connection = await self._connect()
+
+        async with connection.execute("SELECT document FROM initiative WHERE channel = ?", (str(channel),)) as cursor:
+            row = await cursor.fetchone()
+
+        return None if row is None else decode(row[0])
+
+    async def save_tracker(self, document: dict):
+        connection = await self._connect()
+
+        async with self._write_lock:
+            await connection.execute(
+                "INSERT INTO initiative (channel, document) VALUES (?, ?) ON CONFLICT (channel) DO UPDATE SET document = excluded.document",
+                (document["channel"], encode(document))
+            )
+            await connection.commit()
+
+    async def delete_tracker(self, channel: int):
+        connection = await self._connect()
+
+        async with self._write_lock:
+            await connection.execute("DELETE FROM initiative WHERE channel = ?", (str(channel),))
+            await connection.commit()
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from enum import IntFlag
+
+from dice import double_dice
+
+
+class Keyword(IntFlag):
+    ADV = 1
+    DIS = 2
+    TWO_HANDED = 4
+
+
+KEYWORD_NAMES = [(Keyword.ADV, "adv"), (Keyword.DIS, "dis"), (Keyword.TWO_HANDED, "2h")]
+
+
+def keywords_from_list(names: list[str]) -> int:
+    flags = 0
+
+    for flag, name in KEYWORD_NAMES:
+        if name in names:
+            flags |= flag
+
+    return flags
+
+
+def keywords_to_list(flags: int) -> list[str]:
+    return [name for flag, name in KEYWORD_NAMES if flags & flag]
+
+
+class Modifier:
+    __slots__ = ("modifier", "keywords")
+
+    def __init__(self, modifier: int = 0, keywords: int = 0):
+        self.modifier = modifier
+        self.keywords = keywords
+
+    def keyword_list(self) -> list[str]:
+        return keywords_to_list(self.keywords)
+
+    def to_dict(self) -> dict:
+        return {
+            "modifier": self.modifier,
+            "keywords": self.keyword_list()
+        }
+
+    @classmethod
+    def from_dict(cls, dct) -> Modifier:
+        return cls(dct["modifier"], keywords_from_list(dct["keywords"]))
+
+
+class Stat(Modifier):
+    __slots__ = ("name",)
+
+    def __init__(self, name: str, modifier: int = 0, keywords: int = 0):
+        super().__init__(modifier, keywords)
+        self.name = name
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "modifier": self.modifier,
+            "keywords": self.keyword_list()
+        }
+
+    @classmethod
+    def from_dict(cls, dct) -> Stat:
+        return cls(dct["name"], dct["modifier"], keywords_from_list(dct["keywords"]))
+
+
+class Attack:
+    __slots__ = ("name", "hit", "damage", "crit_damage", "keywords", "group", "critrange", "critmultiplier")
+
+    def __init__(self, name: str, hit: int, damage: str, keywords: int = 0, group: int = 0, critrange: int = 20, critmultiplier: int = 2):
+        self.name = name
+        self.hit = hit
+        self.damage = damage
+        self.crit_damage = double_dice(damage)
+        self.keywords = keywords
+        self.group = group
+        self.critrange = critrange
+        self.critmultiplier = critmultiplier
+
+    def keyword_list(self) -> list[str]:
+        return keywords_to_list(self.keywords)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "hit": self.hit,
+            "damage": self.damage,
+            "keywords": self.keyword_list(),
+            "group": self.group,
+            "critrange": self.critrange,
+            "critmultiplier": self.critmultiplier
+        }
+
+    @classmethod
+    def from_dict(cls, dct) -> Attack:
+        return cls(
+            dct["name"],
+            dct["hit"],
+            dct["damage"],
+            keywords_from_list(dct["keywords"]),
+            dct["group"],
+            dct["critrange"],
+            dct["critmultiplier"]
+        )
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from character_store import CharacterWrite, ConflictError
+from memory_store import MemoryStore
+from sqlite_store import SqliteStore
+
+
+# The write rules MongoStore follows, checked against the backends that run without a server
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make():
+        return MemoryStore() if request.param == "memory" else SqliteStore(str(tmp_path / "characters.db"))
+
+    return make
+
+
+def run(make_store, test):
+    async def main():
+        store = make_store()
+
+        try:
+            await test(store)
+        finally:
+            await store.close()
+
+    asyncio.run(main())
+
+
+def new_write(channel: str, sheet: str, name: str, **fields) -> CharacterWrite:
+    return CharacterWrite(None, channel, sheet, name, dict({"channel": channel, "sheet": sheet, "name": name, "name_lower": name.lower()}, **fields))
+
+
+async def names(store, channel: int) -> list[str]:
+    return [document["name"] for document in await store.find_all(channel)]
+
+
+def test_new_character_creates_link_and_sheet(make_store):
+    async def test(store):
+        [document_id] = await store.write_all([new_write("1", "s1", "Goblin", portrait="p", version=1)])
+
+        document = await store.find(1, "Goblin", exact=True)
+        assert document["_id"] == document_id
+        assert document["portrait"] == "p"
+        assert (await store.find_sheet("s1"))["version"] == 1
+
+    run(make_store, test)
+
+
+def test_new_character_matching_a_link_reuses_it(make_store):
+    async def test(store):
+        [first] = await store.write_all([new_write("1", "s1", "Goblin", portrait="a")])
+        [second] = await store.write_all([new_write("1", "s1", "Goblin", portrait="b")])
+
+        assert second == first
+        assert await names(store, 1) == ["Goblin"]
+        assert (await store.find(1, "Goblin", exact=True))["portrait"] == "b"
+
+    run(make_store, test)
+
+
+def test_write_to_removed_link_conflicts(make_store):
+    async def test(store):
+        [document_id] = await store.write_all([new_write("1", "s1", "Goblin", version=1)])
+        await store.delete(document_id)
+
+        with pytest.raises(ConflictError):
+            await store.write_all([CharacterWrite(document_id, "1", "s1", "Goblin", {"portrait": "p"})])
+
+        with pytest.raises(ConflictError):
+            await store.write_all([CharacterWrite(document_id, "1", "s1", "Goblin", {"portrait": "p", "version": 2}, 1)])
+
+        assert await names(store, 1) == []
+        assert await store.find_sheet("s1") is None
+
+    run(make_store, test)
+
+
+def test_known_link_never_creates_a_sheet(make_store):
+    async def test(store):
+        [document_id] = await store.write_all([new_write("1", "s1", "Goblin")])
+
+        with pytest.raises(ConflictError):
+            await store.write_all([CharacterWrite(document_id, "1", "s2", "Goblin", {"sheet": "s2", "portrait": "p"})])
+
+        assert await store.find_sheet("s2") is None
+        assert (await store.find(1, "Goblin", exact=True))["sheet"] == "s1"
+
+    run(make_store, test)
+
+
+def test_stale_version_conflicts_and_writes_nothing(make_store):
+    async def test(store):
+        goblin, orc = await store.write_all([new_write("1", "s1", "Goblin", version=1), new_write("1", "s2", "Orc", version=1)])
+        await store.write_all([CharacterWrite(goblin, "1", "s1", "Goblin", {"portrait": "new", "version": 2}, 1)])
+
+        with pytest.raises(ConflictError):
+            await store.write_all([
+                CharacterWrite(orc, "1", "s2", "Orc", {"portrait": "lost", "version": 2}, 1),
+                CharacterWrite(goblin, "1", "s1", "Goblin", {"portrait": "stale", "version": 2}, 1)
+            ])
+
+        assert (await store.find(1, "Goblin", exact=True))["portrait"] == "new"
+        assert (await store.find(1, "Orc", exact=True)).get("portrait") != "lost"
+        assert (await store.find_sheet("s2"))["version"] == 1
+
+    run(make_store, test)
+
+
+def test_rename_follows_every_link_of_the_sheet(make_store):
+    async def test(store):
+        first, _ = await store.write_all([new_write("1", "s1", "Goblin 1", version=1), new_write("2", "s1", "Goblin 1")])
+        version = (await store.find_sheet("s1"))["version"]
+
+        # A change of case leaves name_lower untouched, so only name is written
+        await store.write_all([CharacterWrite(first, "1", "s1", "GOBLIN 1", {"name": "GOBLIN 1", "version": version + 1}, version)])
+
+        assert await names(store, 1) == ["GOBLIN 1"]
+        assert await names(store, 2) == ["GOBLIN 1"]
+        assert (await store.find(2, "goblin", exact=False))["name"] == "GOBLIN 1"
+
+    run(make_store, test)